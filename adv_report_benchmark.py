@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import adv_report_core
+from adv_report_core import (load_excel_template, prepare_sheets, run_analysis, write_report_xlsx,
+                             trace_stage, frame_rows)
+from adv_report_synth import generate_sheets, offers_for_flow_rows, write_workbook
+
+# 按不同流水规模运行完整流程（加载 → 各calculate_*规则 → 写报告），输出每个阶段的耗时、内存峰值和行数
+# 用法：python adv_report_benchmark.py [--sizes 10000 100000 1000000] [--excel] [--json 结果.json] [--baseline 旧结果.json]
+# 每个规模在独立子进程中运行，规则串行执行，内存峰值不受其他规模/规则影响；
+# 传入--baseline时与旧结果逐阶段比较，任一阶段耗时超过 旧耗时×--max-slowdown 时退出码为1
+
+
+# -------------------------- 配置项 --------------------------
+DEFAULT_SIZES = [10000, 100000, 1000000]
+# 与旧结果比较时，耗时低于该值（秒）的阶段波动较大，不判定为变慢
+MIN_COMPARE_SECONDS = 0.05
+
+
+def benchmark_size(flow_rows, use_excel=False, seed=0):
+    """生成约flow_rows行流水的模拟数据并运行完整流程，返回运行记录
+    数据缓存写到临时目录，不影响本地的缓存
+    """
+    trace = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        adv_report_core.WORKBOOK_CACHE_DIR = os.path.join(tmp_dir, "workbooks")
+
+        with trace_stage(trace, "生成模拟数据") as record:
+            sheets = generate_sheets(offers_for_flow_rows(flow_rows), seed=seed)
+            record["rows_out"] = frame_rows(sheets)
+        if use_excel:
+            workbook_path = os.path.join(tmp_dir, "workbook.xlsx")
+            with trace_stage(trace, "写出模拟数据xlsx", frame_rows(sheets)):
+                write_workbook(sheets, workbook_path)
+            del sheets
+        with trace_stage(trace, "总耗时"):
+            with trace_stage(trace, "加载数据合计"):
+                if use_excel:
+                    sheets, offer_base_info = load_excel_template(workbook_path, trace)
+                else:
+                    sheets, offer_base_info = prepare_sheets(sheets, trace)
+            results = run_analysis(sheets, offer_base_info, max_workers=1, trace=trace)
+            write_report_xlsx(results, os.path.join(tmp_dir, "report.xlsx"), trace)
+    return trace
+
+
+def compare_with_baseline(report, baseline, max_slowdown):
+    """逐规模、逐阶段与旧结果比较耗时，返回变慢的 [(规模, 阶段, 旧耗时, 新耗时)]"""
+    slower = []
+    for size, trace in report.items():
+        old_seconds = {record["stage"]: record["seconds"] for record in baseline.get(size, [])}
+        for record in trace:
+            old = old_seconds.get(record["stage"])
+            if old is None or max(old, record["seconds"]) < MIN_COMPARE_SECONDS:
+                continue
+            if record["seconds"] > old * max_slowdown:
+                slower.append((size, record["stage"], old, record["seconds"]))
+    return slower
+
+
+def print_trace(size, trace):
+    """按阶段打印运行记录（阶段名称放在最后一列，中文名称不影响数字列对齐）"""
+    print(f"== 流水 {size} 行 ==")
+    print(f"{'耗时(秒)':>10}{'内存峰值(MB)':>14}{'输入行数':>12}{'输出行数':>12}  阶段")
+    for record in trace:
+        print(f"{record['seconds']:>14.3f}"
+              f"{record['peak_rss_mb'] if record['peak_rss_mb'] is not None else '-':>18}"
+              f"{record['rows_in'] if record['rows_in'] is not None else '-':>16}"
+              f"{record['rows_out'] if record['rows_out'] is not None else '-':>16}  {record['stage']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按不同流水规模测试完整流程各阶段的耗时和内存")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="流水行数（可传多个）")
+    parser.add_argument("--excel", action="store_true", help="先写出xlsx再按上传流程解析（规模大时生成xlsx较慢）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--json", help="把各规模的运行记录保存为JSON")
+    parser.add_argument("--baseline", help="与之前保存的JSON结果比较耗时")
+    parser.add_argument("--max-slowdown", type=float, default=1.5, help="判定为变慢的耗时倍数（默认1.5）")
+    args = parser.parse_args(argv)
+
+    report = {}
+    for size in args.sizes:
+        start = time.perf_counter()
+        # 每个规模一个新进程，内存峰值互不影响
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            report[str(size)] = pool.submit(benchmark_size, size, args.excel, args.seed).result()
+        print_trace(size, report[str(size)])
+        print(f"（含进程启动共 {time.perf_counter() - start:.1f}s）\n")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        slower = compare_with_baseline(report, baseline, args.max_slowdown)
+        for size, stage, old, new in slower:
+            print(f"[变慢] 流水 {size} 行 {stage}：{old:.3f}s → {new:.3f}s", file=sys.stderr)
+        if slower:
+            return 1
+        print(f"与 {args.baseline} 相比没有阶段变慢超过 {args.max_slowdown} 倍", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
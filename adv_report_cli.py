@@ -0,0 +1,80 @@
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+
+from adv_report_core import load_excel_template, build_report_bundle, trace_stage, trace_to_json
+
+# 命令行批量生成日报：不导入Streamlit，可直接用于定时任务，多个区域可各自并行运行
+# 用法：python adv_report_cli.py 文件1.xlsx [文件2.xlsx ...] [-o 输出目录] [--trace-json]
+# 全部文件成功时退出码为0，任一文件失败时为1
+
+
+def report_output_path(workbook_path, output_dir):
+    """报告文件路径：<输出目录>/广告数据分析报告_<数据文件名>_<日期>.xlsx"""
+    name = os.path.splitext(os.path.basename(workbook_path))[0]
+    return os.path.join(output_dir, f"广告数据分析报告_{name}_{datetime.now().strftime('%Y%m%d')}.xlsx")
+
+
+def generate_report(workbook_path, output_dir):
+    """为单个数据文件生成九个sheet的分析报告并写入磁盘，返回 (报告路径, 运行记录)"""
+    trace = []
+    out_path = report_output_path(workbook_path, output_dir)
+    with trace_stage(trace, "总耗时"):
+        with trace_stage(trace, "加载数据合计"):
+            sheets, offer_base_info = load_excel_template(workbook_path, trace)
+
+        os.makedirs(output_dir, exist_ok=True)
+        # 先写临时文件再替换，避免定时任务读到写了一半的报告
+        tmp_path = f"{out_path}.tmp-{os.getpid()}.xlsx"
+        try:
+            build_report_bundle(sheets, offer_base_info, tmp_path, trace)
+            os.replace(tmp_path, out_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return out_path, trace
+
+
+def format_trace_record(record):
+    """运行记录的一行文本：阶段: 耗时  内存峰值  行数"""
+    text = f"{record['stage']}: {record['seconds']:.2f}s"
+    if record["peak_rss_mb"] is not None:
+        text += f"  峰值内存 {record['peak_rss_mb']:.0f}MB"
+    if record["rows_in"] is not None or record["rows_out"] is not None:
+        text += f"  行数 {record['rows_in'] if record['rows_in'] is not None else '-'}→{record['rows_out'] if record['rows_out'] is not None else '-'}"
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量生成广告数据分析报告（无需启动Streamlit页面）")
+    parser.add_argument("workbooks", nargs="+", help="按模板填写好的Excel数据文件路径")
+    parser.add_argument("-o", "--output-dir", default=".", help="报告输出目录（默认当前目录）")
+    parser.add_argument("--trace-json", action="store_true", help="在报告旁另存运行记录（<报告文件名>.trace.json）")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    failed = []
+    for workbook_path in args.workbooks:
+        try:
+            out_path, trace = generate_report(workbook_path, args.output_dir)
+        except Exception as e:
+            failed.append(workbook_path)
+            print(f"[失败] {workbook_path}：{e}", file=sys.stderr)
+            continue
+        print(f"[完成] {workbook_path} → {out_path}", file=sys.stderr)
+        for record in trace:
+            print(f"    {format_trace_record(record)}", file=sys.stderr)
+        if args.trace_json:
+            with open(f"{os.path.splitext(out_path)[0]}.trace.json", "w", encoding="utf-8") as f:
+                f.write(trace_to_json(trace))
+
+    if failed:
+        print(f"共 {len(failed)}/{len(args.workbooks)} 个文件生成失败", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2501 @@
+import pandas as pd
+import numpy as np
+from datetime import datetime, date, timedelta
+import os
+import json
+import time
+import shutil
+import hashlib
+import importlib.util
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from chinese_calendar import is_workday, is_holiday
+from io import BytesIO
+from pandas.io.parsers import TextParser
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+# 报告计算核心：加载workbook、各分析规则、生成报告。不依赖Streamlit，
+# 页面（adv_report_github.py）和命令行（adv_report_cli.py）共用
+
+logger = logging.getLogger(__name__)
+
+# -------------------------- 配置项 --------------------------
+# 解析后workbook的本地缓存目录（按文件内容哈希存放Parquet）及容量上限，超出后按最近最少使用淘汰
+WORKBOOK_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "workbooks")
+WORKBOOK_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# 加载/预处理逻辑变化时递增，使旧缓存自动失效
+WORKBOOK_CACHE_VERSION = 7
+# 报告xlsx的写出方式：streaming为openpyxl只写模式逐行写出（内存占用不随行数增长），openpyxl为pandas默认写法
+REPORT_WRITER = "streaming"
+# 并行执行分析规则的线程数（规则之间只读共享sheets，用线程避免在进程间复制整份数据）
+ANALYSIS_MAX_WORKERS = min(8, os.cpu_count() or 1)
+# event事件sheet分块流式读取时每块的行数（只保留按键计数的汇总，不保留原始行）
+EVENT_CHUNK_ROWS = 100000
+# 运行记录中各阶段内存峰值的采样间隔（秒）
+TRACE_SAMPLE_INTERVAL = 0.02
+# 利润变化拆解中，流水或利润率贡献占比超过该值时判定为该因素主导，否则为共同影响
+PROFIT_DRIVER_SHARE = 0.8
+# 最新两天汇总表的层级：{层级名称: 分组字段}（空列表为总体），分组字段可以是二级/三级广告主或流水汇总中的任意维度列（如GEO、App ID）
+# Offer使用字符串形式的Offer Id，与event中提取的Offer Id一致，Offer所在层级也有reject数
+ROLLUP_LEVELS = {
+    "总体": [],
+    "三级广告主": ["三级广告主"],
+    "二级广告主": ["二级广告主"],
+    "Advertiser": ["Advertiser"],
+    "Offer": ["Offer Id"],
+    "Affiliate": ["Affiliate"],
+    # 三级广告主 → Advertiser → Offer → Affiliate 逐层小计，报告可按上层维度筛选下钻
+    "三级广告主 > Advertiser": ["三级广告主", "Advertiser"],
+    "三级广告主 > Advertiser > Offer": ["三级广告主", "Advertiser", "Offer Id"],
+    "三级广告主 > Advertiser > Offer > Affiliate": ["三级广告主", "Advertiser", "Offer Id", "Affiliate"],
+}
+# 按单个维度做最新两天对比的报告sheet：{sheet名称: 分组字段}（列同Advertiser数据，维度不在reject可拆分的字段中时无reject列）
+DIMENSION_COMPARE_SHEETS = {
+    "10-GEO数据": ["GEO"],
+    "11-App ID数据": ["App ID"],
+}
+
+
+# ====================== 运行记录（各阶段耗时/内存/行数） ======================
+# trace为list，每个阶段追加一条记录：
+# {"stage": 阶段名称, "seconds": 耗时, "peak_rss_mb": 阶段内进程常驻内存峰值, "rows_in": 输入行数, "rows_out": 输出行数}
+# 并行执行的规则共享同一个进程，peak_rss_mb为该阶段运行期间整个进程的峰值
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_mb():
+    """当前进程常驻内存（MB），只支持Linux（读取/proc），其他平台返回None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def frame_rows(obj):
+    """统计参数/结果中DataFrame的总行数（dict/tuple/list中的DataFrame累加），不含DataFrame时返回None"""
+    if isinstance(obj, pd.DataFrame):
+        return len(obj)
+    if isinstance(obj, dict):
+        obj = list(obj.values())
+    if isinstance(obj, (tuple, list)):
+        counts = [n for n in map(frame_rows, obj) if n is not None]
+        return sum(counts) if counts else None
+    return None
+
+
+@contextmanager
+def trace_stage(trace, stage, rows_in=None):
+    """记录一个阶段的运行情况，用法：
+        with trace_stage(trace, "阶段名称", 输入行数) as record:
+            ...
+            record["rows_out"] = 输出行数
+    trace为None时不记录；记录在阶段开始时加入trace（按开始顺序排列），结束时补全耗时和内存峰值
+    """
+    record = {"stage": stage, "seconds": None, "peak_rss_mb": None, "rows_in": rows_in, "rows_out": None}
+    if trace is None:
+        yield record
+        return
+    trace.append(record)
+    peak = [current_rss_mb()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(TRACE_SAMPLE_INTERVAL):
+            peak[0] = max(peak[0], current_rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True) if peak[0] is not None else None
+    if sampler is not None:
+        sampler.start()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 4)
+        done.set()
+        if sampler is not None:
+            sampler.join()
+            record["peak_rss_mb"] = round(max(peak[0], current_rss_mb()), 1)
+
+
+def trace_to_json(trace):
+    """运行记录导出为JSON文本"""
+    return json.dumps(trace, ensure_ascii=False, indent=2)
+
+
+# Excel模板中各sheet的内部名称与实际sheet名称的对应关系
+TEMPLATE_SHEETS = {
+    "流水数据": "1--过去30天总流水",
+    "reject规则": "2--reject规则匹配",
+    "广告主匹配": "3--匹配业务负责广告主",
+    "event事件": "4--event事件",
+    "日均目标流水": "5--本月日均目标流水",
+    "预算黑名单": "6--预算黑名单",
+    "流量类型": "7--流量类型"}
+
+# 安装了python-calamine时优先使用calamine引擎（Rust实现，解析速度远快于openpyxl）
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else "openpyxl"
+
+
+def read_workbook_bytes(excel_path):
+    """读取上传文件/本地路径的原始字节"""
+    if hasattr(excel_path, "getvalue"):
+        return excel_path.getvalue()
+    if hasattr(excel_path, "read"):
+        return excel_path.read()
+    with open(excel_path, "rb") as f:
+        return f.read()
+
+
+def read_template_sheets(excel_path, trace=None):
+    """只打开一次workbook，依次解析模板中的全部sheet
+    参数：
+        excel_path: 本地路径或上传的文件对象
+        trace: 可选运行记录list，传入时记录每个sheet的解析耗时和行数
+    """
+    data = read_workbook_bytes(excel_path)
+    sheets = {}
+    # 不并行解析：同一个workbook句柄不能跨线程共享（calamine会报借用冲突，openpyxl为纯Python解析受GIL限制），
+    # 每个线程各开一个句柄又要把整个文件重复解压，因此只打开一次，在同一个句柄上顺序解析全部sheet
+    with pd.ExcelFile(BytesIO(data), engine=EXCEL_ENGINE) as xls:
+        for key, sheet_name in TEMPLATE_SHEETS.items():
+            if key == "event事件":
+                continue
+            with trace_stage(trace, f"解析 {sheet_name}") as record:
+                sheets[key] = xls.parse(sheet_name)
+                record["rows_out"] = len(sheets[key])
+        # event事件是最大的sheet，在同一个句柄上分块流式读取，只保留计数汇总
+        with trace_stage(trace, f"解析 {TEMPLATE_SHEETS['event事件']}（分块汇总）") as record:
+            sheets["event汇总"] = read_event_counts(xls.book, record)
+            record["rows_out"] = len(sheets["event汇总"])
+    return sheets
+
+
+def convert_excel_cell(value):
+    """单元格值转换，与pandas read_excel一致：整数值的浮点数转为int，日期转为Timestamp，空单元格为空字符串"""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, date):
+        return pd.Timestamp(value)
+    if isinstance(value, timedelta):
+        return pd.Timedelta(value)
+    return value
+
+
+def iter_sheet_rows(book, sheet_name):
+    """在已打开的workbook句柄（pd.ExcelFile.book）上逐行读取sheet的单元格值（第一行为表头），不构造整表DataFrame
+    calamine按sheet整块解码为紧凑的Rust单元格后逐行转换为Python值；openpyxl（只读模式打开）边解压边读取
+    """
+    if EXCEL_ENGINE == "calamine":
+        rows = book.get_sheet_by_name(sheet_name).iter_rows()
+    else:
+        rows = book[sheet_name].iter_rows(values_only=True)
+    for row in rows:
+        yield [convert_excel_cell(value) for value in row]
+
+
+# event汇总的键：原始event行按这些字段计数（"事件数"列），Offer Id从Offer Name中提取
+EVENT_COUNT_KEYS = ["Time", "Offer Id", "Advertiser", "Affiliate", "Event"]
+
+
+def count_event_rows(event_df):
+    """原始event行按EVENT_COUNT_KEYS计数（空值单独成组），Time转为日期"""
+    event_df = event_df.assign(**{
+        "Time": pd.to_datetime(event_df["Time"]).dt.date,
+        "Offer Id": extract_offer_ids(event_df["Offer Name"]),
+    })
+    return event_df.groupby(EVENT_COUNT_KEYS, dropna=False, sort=False).size().reset_index(name="事件数")
+
+
+def aggregate_event_chunks(chunks):
+    """逐块计数后合并为event汇总：{EVENT_COUNT_KEYS..., 事件数}
+    各块按object读取，合并后再按整列推断维度列类型（与整表读取一致，如整数和空值混合的列为float64）
+    """
+    parts = [count_event_rows(chunk) for chunk in chunks]
+    if not parts:
+        return pd.DataFrame({**{col: pd.Series(dtype=object) for col in EVENT_COUNT_KEYS},
+                             "事件数": pd.Series(dtype="int64")})
+    counts = pd.concat(parts, ignore_index=True).groupby(
+        EVENT_COUNT_KEYS, dropna=False, sort=False)["事件数"].sum().reset_index()
+    for col in ["Advertiser", "Affiliate", "Event"]:
+        values = counts[col].astype(object).where(counts[col].notna(), "")
+        counts[col] = TextParser([[col]] + [[value] for value in values], header=0, skip_blank_lines=False).read()[col].to_numpy()
+    return counts
+
+
+def read_event_counts(book, record=None):
+    """分块（EVENT_CHUNK_ROWS行）流式读取event事件sheet并计数，内存占用取决于不同键的数量而不是event行数
+    全空的行不参与计数（这些行Time为空，不会被任何规则统计）；传入运行记录时写入原始行数
+    """
+    rows = iter_sheet_rows(book, TEMPLATE_SHEETS["event事件"])
+    header = next(rows, None)
+    raw_rows = [0]
+
+    def chunks():
+        block = []
+        for row in rows:
+            if any(value != "" for value in row):
+                block.append(row)
+            if len(block) >= EVENT_CHUNK_ROWS:
+                raw_rows[0] += len(block)
+                yield TextParser([header] + block, header=0, dtype=object, skip_blank_lines=False).read()
+                block = []
+        if block:
+            raw_rows[0] += len(block)
+            yield TextParser([header] + block, header=0, dtype=object, skip_blank_lines=False).read()
+
+    counts = aggregate_event_chunks(chunks() if header is not None else [])
+    if record is not None:
+        record["rows_in"] = raw_rows[0]
+    return counts
+
+
+def workbook_cache_key(data):
+    """根据workbook内容计算缓存key，相同文件无论文件名如何都命中同一份缓存"""
+    digest = hashlib.sha256(data)
+    digest.update(f"v{WORKBOOK_CACHE_VERSION}".encode())
+    return digest.hexdigest()
+
+
+# 混合类型的object列（如App ID同时有数字和包名）无法直接写入Parquet，
+# 按字符串存储并额外记录每个值的原始类型，读取时还原
+MIXED_KIND_PREFIX = "__kind__"
+MIXED_KIND_DECODERS = {
+    "int": int,
+    "float": float,
+    "bool": lambda v: v == "True",
+    "datetime": datetime.fromisoformat,
+    "date": lambda v: datetime.fromisoformat(v).date(),
+    "Timestamp": pd.Timestamp,
+}
+
+
+def encode_frame_for_parquet(df):
+    """将无法直接写入Parquet的object列编码为 字符串列 + 类型列"""
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True) in ("string", "empty", "date", "boolean"):
+            continue
+        values = df[col]
+        kinds = values.map(lambda v: None if pd.isna(v) else type(v).__name__.replace("64", ""))
+        df[col] = values.astype(str).where(kinds.notna(), None)
+        df[f"{MIXED_KIND_PREFIX}{col}"] = kinds
+    return df
+
+
+def decode_frame_from_parquet(df):
+    """还原encode_frame_for_parquet编码过的混合类型列"""
+    # Parquet读回的字符串列空值为None，统一还原为read_excel解析出的NaN（None和NaN在判断真假时结果不同）
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notna(), np.nan)
+    for kind_col in [c for c in df.columns if c.startswith(MIXED_KIND_PREFIX)]:
+        col = kind_col[len(MIXED_KIND_PREFIX):]
+        values = df[col].astype(object)
+        for kind, decoder in MIXED_KIND_DECODERS.items():
+            mask = df[kind_col] == kind
+            if mask.any():
+                values[mask] = values[mask].map(decoder)
+        df[col] = values.where(df[kind_col].notna(), np.nan)
+        df = df.drop(columns=[kind_col])
+    return df
+
+
+def load_cached_workbook(cache_key):
+    """读取缓存的解析结果，未命中返回None；命中时刷新目录时间用于LRU淘汰"""
+    cache_path = os.path.join(WORKBOOK_CACHE_DIR, cache_key)
+    manifest_path = os.path.join(cache_path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        sheets = {
+            name: decode_frame_from_parquet(pd.read_parquet(os.path.join(cache_path, file_name)))
+            for name, file_name in manifest["sheets"].items()
+        }
+        offer_base_info = decode_frame_from_parquet(pd.read_parquet(os.path.join(cache_path, manifest["offer_base_info"])))
+    except Exception as e:
+        logger.warning("读取workbook缓存失败，重新解析：%s", e)
+        return None
+    os.utime(cache_path)
+    return sheets, offer_base_info
+
+
+def save_cached_workbook(cache_key, sheets, offer_base_info):
+    """将解析结果写入缓存目录（先写临时目录再重命名，避免读到写了一半的缓存）"""
+    cache_path = os.path.join(WORKBOOK_CACHE_DIR, cache_key)
+    if os.path.exists(cache_path):
+        return
+    tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(tmp_path, exist_ok=True)
+        manifest = {"sheets": {}, "offer_base_info": "offer_base_info.parquet"}
+        for i, (name, df) in enumerate(sheets.items()):
+            file_name = f"sheet_{i}.parquet"
+            encode_frame_for_parquet(df).to_parquet(os.path.join(tmp_path, file_name), index=False)
+            manifest["sheets"][name] = file_name
+        encode_frame_for_parquet(offer_base_info).to_parquet(os.path.join(tmp_path, manifest["offer_base_info"]), index=False)
+        with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.rename(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning("写入workbook缓存失败，本次不缓存：%s", e)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+    evict_workbook_cache()
+
+
+def evict_workbook_cache(max_bytes=WORKBOOK_CACHE_MAX_BYTES):
+    """缓存总大小超过上限时，按最近使用时间从旧到新删除"""
+    entries = []
+    for entry in os.scandir(WORKBOOK_CACHE_DIR):
+        if not entry.is_dir() or ".tmp-" in entry.name:
+            continue
+        size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+        entries.append((entry.stat().st_mtime, size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+# 流水汇总的分组键：Offer ID × Affiliate × Time，外加规则中按行读取的维度字段
+# 维度字段也作为分组键（不取每个Offer的第一个非空值），空值单独成组，规则读到的维度值与原始流水逐行一致
+FLOW_CUBE_KEYS = ["Offer ID", "Affiliate", "Time"]
+FLOW_CUBE_DIMENSION_COLS = ["Advertiser", "App ID", "GEO", "Adv Offer ID", "Status"]
+FLOW_CUBE_METRICS = {
+    "Total Clicks": "sum",
+    "Total Conversions": "sum",
+    "Total Revenue": "sum",
+    "Total Cost": "sum",
+    "Total Profit": "sum",
+    "Online hour": "max",
+}
+
+
+def build_flow_cube(flow_df):
+    """将过去30天流水按 Offer ID × Affiliate × Time 预聚合，加载后只计算一次，所有规则共用
+    规则会按行读取的Advertiser/App ID/GEO/Adv Offer ID/Status作为附带的分组键（同一Offer同一天同一Affiliate
+    只有一行取值，不增加行数；个别行为空时单独成组，保证与原始流水上的结果一致）；
+    Total Caps/Payin只按Offer取值，放在Offer维度表中
+    - dropna=False：维度为空的行保留为单独分组，与各规则直接在原始流水上聚合的结果一致
+    - sort=False：分组按在原始流水中首次出现的顺序排列，规则中的unique/drop_duplicates/first与原始流水上的结果一致
+    """
+    keys = FLOW_CUBE_KEYS + [col for col in FLOW_CUBE_DIMENSION_COLS if col in flow_df.columns]
+    metrics = {col: how for col, how in FLOW_CUBE_METRICS.items() if col in flow_df.columns}
+    # 维度字段保持category（见FLOW_DIMENSION_COLS），规则中对其分组需observed=True
+    cube = flow_df.groupby(keys, dropna=False, sort=False, observed=True).agg(metrics).reset_index()
+    # 与event的Offer Id关联、拼接文字用的字符串形式，加载时只转换一次
+    cube["Offer Id"] = offer_id_labels(cube["Offer ID"]).astype("category")
+    return cube
+
+
+def decategorize_frame(df):
+    """把category列还原为object列（规则中的小结果表会被fillna/拼接，保持与原始读取相同的类型）"""
+    for col in df.columns[df.dtypes == "category"]:
+        df[col] = df[col].astype(object)
+    return df
+
+
+# 加载时统一的列类型：高重复的维度字段字典编码为category，流水汇总中保持category（只保存整数编码+字典）
+# 规则中对这些列分组时需要observed=True，只保留实际出现的组合；填充空值用fill_dimension，
+# 汇总后的小表在fillna/拼接前用decategorize_frame还原；数值指标保持64位，
+# 窄整数在带空值分组的求和中会沿用原类型而溢出
+FLOW_DIMENSION_COLS = ["Advertiser", "Affiliate", "GEO", "App ID", "Status"]
+# event的Affiliate会和流水汇总的分组结果（已还原为object）做outer关联，category键在outer关联后无法fillna，保持object
+EVENT_DIMENSION_COLS = ["Advertiser", "Event"]
+
+
+def fill_dimension(series, value):
+    """维度列填充空值（value可以是标量或Series）：category列先补充新取值的类别，保持字典编码"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        values = pd.Series(value).dropna().unique() if isinstance(value, pd.Series) else [value]
+        series = series.cat.add_categories(pd.Index(values).difference(series.cat.categories))
+    return series.fillna(value)
+
+
+def compact_frame_dtypes(df, dimension_cols):
+    """原地把纯字符串的维度列转为category（混合类型的列保持object，值和空值判断不变）"""
+    for col in dimension_cols:
+        if col in df.columns and df[col].dtype == object \
+                and pd.api.types.infer_dtype(df[col], skipna=True) == "string":
+            df[col] = df[col].astype("category")
+    return df
+
+
+# Offer维度表字段（不随日期变化），各规则通过Offer Id关联
+OFFER_DIM_COLS = ["Adv Offer ID", "GEO", "App ID", "Advertiser", "Total Caps", "Status", "Payin"]
+# 预算规则按Offer在流水中的第一行（Time非空）取值的字段：{原字段: 维度表中的列名}
+OFFER_FIRST_ROW_COLS = {"Total Caps": "首行Total Caps", "Payin": "首行Payin"}
+
+
+def offer_id_labels(offer_ids):
+    """流水中的Offer ID转为字符串形式（与astype(str)结果相同，和event中提取的Offer Id一致）
+    Offer ID重复度很高，只对去重后的值转换一次，再按编码映射回每一行
+    """
+    codes, uniques = pd.factorize(offer_ids, use_na_sentinel=False)
+    labels = pd.Index(uniques).astype(str).to_numpy(dtype=object)
+    return pd.Series(labels[codes], index=offer_ids.index, dtype=object)
+
+
+def build_offer_dimension(flow_df):
+    """构建Offer维度表：每个Offer ID各字段取第一个非空值（与逐组 bfill().ffill().iloc[0] 结果一致），
+    另带OFFER_FIRST_ROW_COLS中按第一行取的字段（为空时保持为空）
+    同时带两种关联键：Offer Id（字符串，与event关联）和offerid（流水中的原始Offer ID，与流水汇总关联）；
+    该表在各规则间共享，规则内不要原地修改
+    """
+    offer_dim = flow_df.groupby("Offer ID")[OFFER_DIM_COLS].first().reset_index()
+    first_row_cols = [col for col in OFFER_FIRST_ROW_COLS if col in flow_df.columns]
+    first_rows = flow_df.loc[flow_df["Time"].notna(), ["Offer ID", *first_row_cols]].drop_duplicates("Offer ID")
+    offer_dim = decategorize_frame(
+        offer_dim.merge(first_rows.rename(columns=OFFER_FIRST_ROW_COLS), on="Offer ID", how="left")
+    )
+    offer_dim.insert(0, "Offer Id", offer_id_labels(offer_dim["Offer ID"]))
+    return offer_dim.rename(columns={"Offer ID": "offerid"})
+
+
+def offer_dimension_by_id(offer_base_info):
+    """返回以offerid（原始Offer ID）为关联键的Offer维度表（不修改共享的offer_base_info）"""
+    return offer_base_info.drop(columns="Offer Id")
+
+
+def load_excel_template(excel_path, trace=None):
+    """加载Excel模板的所有sheet数据（相同内容的文件直接读取本地Parquet缓存）
+    传入trace时记录各sheet解析、流水汇总和Offer维度表的运行情况
+    """
+    data = read_workbook_bytes(excel_path)
+    cache_key = workbook_cache_key(data)
+    with trace_stage(trace, "读取缓存") as record:
+        cached = load_cached_workbook(cache_key)
+        record["rows_out"] = frame_rows(cached)
+    if cached is not None:
+        return cached
+
+    sheets, offer_base_info = prepare_sheets(read_template_sheets(BytesIO(data), trace), trace)
+
+    with trace_stage(trace, "写入缓存", frame_rows(sheets)):
+        save_cached_workbook(cache_key, sheets, offer_base_info)
+    return sheets,offer_base_info
+
+
+def prepare_sheets(sheets, trace=None):
+    """对解析出的原始sheet做预处理（原地修改sheets，原始流水换成流水汇总），返回 (sheets, offer_base_info)
+    单独拆出便于直接用内存中构造的数据运行（如性能测试），不经过Excel解析和缓存
+    """
+    # 原始流水只用于构建流水汇总和Offer维度表，之后不再保留（也不写入缓存）
+    flow_df = sheets.pop("流水数据")
+    # 数据预处理：日期格式转换,后面涉及到大量日期匹配，避免出现错误
+    flow_df["Time"] = pd.to_datetime(flow_df["Time"]).dt.date
+    # 内存中构造的原始event行（如性能测试）按与分块读取相同的方式计数
+    if "event事件" in sheets:
+        with trace_stage(trace, "event汇总", len(sheets["event事件"])) as record:
+            sheets["event汇总"] = aggregate_event_chunks([sheets.pop("event事件")])
+            record["rows_out"] = len(sheets["event汇总"])
+    compact_frame_dtypes(flow_df, FLOW_DIMENSION_COLS)
+    compact_frame_dtypes(sheets["event汇总"], EVENT_DIMENSION_COLS)
+
+    # 各规则共用的预聚合流水，后续规则不再扫描原始流水行
+    with trace_stage(trace, "流水汇总", len(flow_df)) as record:
+        sheets["流水汇总"] = build_flow_cube(flow_df)
+        record["rows_out"] = len(sheets["流水汇总"])
+    
+    #用于后续所有预算详细信息的匹配，以下这些维度信息不会随任何日期发生改变
+    with trace_stage(trace, "Offer维度表", len(flow_df)) as record:
+        offer_base_info = build_offer_dimension(flow_df)
+        record["rows_out"] = len(offer_base_info)
+    return sheets, offer_base_info
+
+
+# ======================
+# 最新两天汇总表（总数据 / Advertiser数据 / Affiliate数据共用）
+# ======================
+TWO_DAY_LABELS = ("最新", "次新")
+# reject事件可以拆分的维度：分组字段都在其中的层级才有reject数
+ROLLUP_REJECT_KEYS = ["三级广告主", "二级广告主", "Advertiser", "Offer Id", "Affiliate"]
+# 由广告主匹配表按Advertiser匹配得到的维度
+ADV_MATCH_KEYS = ["二级广告主", "三级广告主"]
+
+
+def latest_two_days(flow_df):
+    """流水中最新的两天，返回 (最新一天, 次新一天)"""
+    latest_dates = pd.to_datetime(flow_df["Time"], errors="coerce").drop_duplicates().nlargest(2).sort_values().dt.date
+    return latest_dates.iloc[1], latest_dates.iloc[0]
+
+
+def sum_two_days(df, keys, value_cols, date_new, date_old):
+    """最新两天的数据按keys一次分组求和，每个指标按日期拆成 最新/次新 两列（某天没有数据按0计，keys中的空值单独成组）
+    value_cols: {输出的指标名: 原列名}
+    """
+    rows = df[df["Time"].isin([date_new, date_old])]
+    wide = rows[keys].copy()
+    for label, day in zip(TWO_DAY_LABELS, [date_new, date_old]):
+        on_day = rows["Time"] == day
+        for name, col in value_cols.items():
+            wide[f"{label} {name}"] = rows[col].where(on_day, 0)
+    return decategorize_frame(wide.groupby(keys, dropna=False, observed=True, sort=False).sum().reset_index())
+
+
+def rollup_dimensions(levels):
+    """各层级用到的全部分组字段（按首次出现的顺序）"""
+    return list(dict.fromkeys(dim for dims in levels.values() for dim in dims))
+
+
+def sum_rollup_level(sums, dims):
+    """在最细粒度的汇总上按dims再汇总（dims为空时为总体，只有一行）"""
+    value_cols = [col for col in sums.columns if col.startswith(TWO_DAY_LABELS)]
+    if not dims:
+        return sums[value_cols].sum().to_frame().T
+    return sums.groupby(dims)[value_cols].sum()
+
+
+def build_two_day_rollup(sheets, date_new, date_old, reject_event_df, levels=None):
+    """最新两天按各层级汇总成一张表（类似SQL的GROUPING SETS），levels默认为ROLLUP_LEVELS
+    流水按各层级用到的维度（再加Advertiser，用于匹配二级/三级广告主）只分组一次，reject按ROLLUP_REJECT_KEYS只分组一次，
+    各层级都在这两份最细粒度的汇总上再聚合；
+    返回列：汇总层级, 各层级用到的维度（不属于该层级的维度为空），
+    最新/次新 Revenue、Profit、Conversions、Total reject（分组字段不全在ROLLUP_REJECT_KEYS中的层级没有reject数，为空）
+    """
+    levels = ROLLUP_LEVELS if levels is None else levels
+    flow_df = sheets["流水汇总"]
+    adv_match_df = sheets["广告主匹配"]
+    dimensions = rollup_dimensions(levels)
+
+    flow_keys = ["Advertiser", *[dim for dim in dimensions if dim not in ["Advertiser", *ADV_MATCH_KEYS]]]
+    flow_sums = sum_two_days(flow_df, flow_keys, {
+        "Revenue": "Total Revenue",
+        "Profit": "Total Profit",
+        "Conversions": "Total Conversions"
+    }, date_new, date_old)
+    # 二级/三级广告主在汇总后匹配（总体与三级广告主在同一张报告表中，同样按匹配后的流水计算）
+    matched_sums = pd.merge(flow_sums, adv_match_df[["Advertiser", *ADV_MATCH_KEYS]], on="Advertiser", how="left")
+    rejects = reject_event_df[reject_event_df["是否为reject"] == True]
+    reject_sums = sum_two_days(rejects, ROLLUP_REJECT_KEYS, {"Total reject": "事件数"}, date_new, date_old)
+
+    tables = []
+    for level, dims in levels.items():
+        source = matched_sums if not dims or set(dims) & set(ADV_MATCH_KEYS) else flow_sums
+        level_df = sum_rollup_level(source, dims)
+        if set(dims) <= set(ROLLUP_REJECT_KEYS):
+            level_rejects = sum_rollup_level(reject_sums, dims)
+            index = level_df.index.union(level_rejects.index)
+            level_df = level_df.reindex(index).join(level_rejects.reindex(index)).fillna(0)
+        level_df = level_df.reset_index() if dims else level_df.reset_index(drop=True)
+        # 维度列转为object，拼接后整数的Offer ID不会变成浮点数
+        level_df[dims] = level_df[dims].astype(object)
+        level_df.insert(0, "汇总层级", level)
+        tables.append(level_df)
+    return pd.concat(tables, ignore_index=True).reindex(columns=["汇总层级", *dimensions, *[
+        f"{label} {metric}" for label in TWO_DAY_LABELS for metric in ["Revenue", "Profit", "Conversions", "Total reject"]
+    ]])
+
+
+def add_two_day_ratios(table, margin_fill=None):
+    """在含 最新/次新 Revenue、Profit 列的表上补充利润率和三项变化幅度（变化幅度 = (最新-次新)/次新）
+    margin_fill: 流水为0时利润率的取值，None表示保留空值
+    """
+    for label in TWO_DAY_LABELS:
+        margin = table[f"{label} Profit"] / table[f"{label} Revenue"].replace(0, np.nan)
+        table[f"{label} 利润率"] = margin if margin_fill is None else margin.fillna(margin_fill)
+    for metric in ["Revenue", "Profit", "利润率"]:
+        table[f"{metric} 变化幅度"] = (table[f"最新 {metric}"] - table[f"次新 {metric}"]) / table[f"次新 {metric}"].replace(0, np.nan)
+    return table
+
+
+def rollup_level(rollup, level, margin_fill=None, levels=None):
+    """从汇总表取出某一层级的两日对比，按维度排序，列为：维度..., 最新/次新 Revenue、Profit，最新/次新 利润率，
+    Revenue/Profit/利润率 变化幅度，以及（有reject数的层级）最新/次新 Total reject、reject率（reject/(reject+转化)）
+    levels: 生成汇总表时的层级定义，默认为ROLLUP_LEVELS
+    """
+    dims = (ROLLUP_LEVELS if levels is None else levels)[level]
+    rows = rollup[rollup["汇总层级"] == level].reset_index(drop=True)
+    table = rows[[*dims, "最新 Revenue", "最新 Profit", "次新 Revenue", "次新 Profit"]].infer_objects()
+    add_two_day_ratios(table, margin_fill)
+    if set(dims) <= set(ROLLUP_REJECT_KEYS):
+        for label in TWO_DAY_LABELS:
+            reject = rows[f"{label} Total reject"]
+            # 类型与逐日outer关联后填0的结果一致：每行当天都有reject时为整数，否则为浮点数
+            table[f"{label} Total reject"] = reject.astype("int64") if (reject > 0).all() else reject
+            table[f"{label} reject率"] = reject / (reject + rows[f"{label} Conversions"]).replace(0, np.nan)
+    return table
+
+
+def compare_two_days(sheets, dims, date_new, date_old, reject_event_df, margin_fill=None):
+    """按任意维度做最新两天对比（如["GEO"]、["App ID"]、["Offer ID", "Affiliate"]），只汇总这一个层级
+    dims可以是二级/三级广告主或流水汇总中的任意维度列，返回列同rollup_level
+    """
+    levels = {"对比": list(dims)}
+    rollup = build_two_day_rollup(sheets, date_new, date_old, reject_event_df, levels)
+    return rollup_level(rollup, "对比", margin_fill, levels)
+
+
+def two_day_column_names(date_new, date_old):
+    """对比表中 最新/次新 列名改为具体日期（Advertiser数据/Affiliate数据的列名）"""
+    names = {}
+    for label, day in zip(TWO_DAY_LABELS, [date_new, date_old]):
+        names.update({
+            f"{label} Revenue": f"{day} Total Revenue",
+            f"{label} Profit": f"{day} Total Profit",
+            f"{label} 利润率": f"{day} 利润率",
+            f"{label} Total reject": f"{day} Total reject",
+            f"{label} reject率": f"{day} reject率",
+        })
+    return names
+
+
+def calculate_total_data(sheets, date_new, date_old, rollup):
+    """规则1：按广告主计算日均数据波动"""
+    daily_target_df = sheets["日均目标流水"].copy()
+    
+    # 步骤a-c：从最新两天汇总表取三级广告主和总体数据（环比 = (最新-次新)/次新，某天没有流水时利润率按0计）
+    level3_merged = rollup_level(rollup, "三级广告主", margin_fill=0)
+    total_merged = rollup_level(rollup, "总体", margin_fill=0)
+    total_merged["三级广告主"] = "总体"
+    
+    # 步骤d：合并b和c的数据，匹配日均目标流水
+    final_total = pd.concat([level3_merged, total_merged], ignore_index=True)
+    final_total = pd.merge(
+        final_total,
+        daily_target_df[["三级广告主", "本月日均目标流水(美金)"]],
+        on="三级广告主",
+        how="left"
+    ).fillna({"本月日均目标流水(美金)": 0})
+    
+    # 调整列顺序
+    final_total = final_total[[
+        "三级广告主", "本月日均目标流水(美金)", "最新 Revenue", "次新 Revenue", "Revenue 变化幅度",
+        "最新 Profit", "次新 Profit", "Profit 变化幅度", "最新 利润率", "次新 利润率", "利润率 变化幅度"
+    ]]
+    
+    
+    rename_map = {
+        "三级广告主": "跟进广告主",
+        "本月日均目标流水(美金)": "本月日均目标流水(美金)",
+        "最新 Revenue": f"{date_new} 总流水(美金)",
+        "次新 Revenue": f"{date_old} 总流水(美金)",
+        "Revenue 变化幅度": "流水日环比",
+        "最新 Profit": f"{date_new} 总利润(美金)",
+        "次新 Profit": f"{date_old} 总利润(美金)",
+        "Profit 变化幅度": "利润日环比",
+        "最新 利润率": f"{date_new} 利润率",
+        "次新 利润率": f"{date_new} 利润率",
+        "利润率 变化幅度": "利润率日环比"
+    }
+    final_total = final_total.rename(columns={k: v for k, v in rename_map.items() if k in final_total.columns})
+
+    
+    return final_total
+
+
+
+# ======================
+# 利润变化拆解（预算波动 / 利润大幅下降 / 利润影响分析共用）
+# ======================
+PROFIT_DRIVER_TEXT = {"无": "无明显因素", "流水": "流水变化", "利润率": "利润率变化", "共同": "流水变化和利润率变化"}
+
+
+def decompose_profit_change(rev_old, profit_old, rev_new, profit_new, missing_margin=0.0, net_total=False, ndigits=None):
+    """把利润变化拆成流水贡献和利润率贡献，输入为对齐的数组/Series（任意粒度，标量也可），一次算出全部行：
+        流水贡献 = (新流水-旧流水) × 旧利润率（旧流水为0时为0）
+        利润率贡献 = 新流水 × (新利润率-旧利润率)（新流水为0时为0）
+    参数：
+        missing_margin: 旧流水为0时旧利润率按该值计；None表示此时利润率贡献也为0
+        net_total: 贡献占比的分母，False为 |流水贡献|+|利润率贡献|，True为 |流水贡献+利润率贡献|
+        ndigits: 先把两项贡献保留几位小数，再判断主导因素（None不保留）
+    返回：
+        (流水贡献, 利润率贡献, 主导因素) 三个numpy数组，主导因素为 流水/利润率/共同，贡献合计小于1e-6时为 无
+    """
+    rev_old, profit_old, rev_new, profit_new = (np.asarray(v, dtype=float) for v in (rev_old, profit_old, rev_new, profit_new))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margin_old = np.where(rev_old != 0, profit_old / rev_old, np.nan)
+        margin_new = np.where(rev_new != 0, profit_new / rev_new, np.nan)
+        rev_contrib = np.where(rev_old != 0, (rev_new - rev_old) * margin_old, 0.0)
+        if missing_margin is None:
+            margin_contrib = np.where((rev_new != 0) & (rev_old != 0), rev_new * (margin_new - margin_old), 0.0)
+        else:
+            margin_base = np.where(rev_old != 0, margin_old, missing_margin)
+            margin_contrib = np.where(rev_new != 0, rev_new * (margin_new - margin_base), 0.0)
+        if ndigits is not None:
+            rev_contrib = round_series(pd.Series(rev_contrib.ravel()), ndigits).to_numpy().reshape(rev_contrib.shape)
+            margin_contrib = round_series(pd.Series(margin_contrib.ravel()), ndigits).to_numpy().reshape(margin_contrib.shape)
+
+        total = np.abs(rev_contrib + margin_contrib) if net_total else np.abs(rev_contrib) + np.abs(margin_contrib)
+        has_factor = total >= 1e-6
+        driver = np.select(
+            [~has_factor, np.abs(rev_contrib) / total > PROFIT_DRIVER_SHARE, np.abs(margin_contrib) / total > PROFIT_DRIVER_SHARE],
+            ["无", "流水", "利润率"],
+            default="共同"
+        ).astype(object)
+    return rev_contrib, margin_contrib, driver
+
+
+# ======================
+# 下游影响文本批量渲染（预算波动 / 利润大幅下降共用）
+# ======================
+def safe_div_series(a, b):
+    """按列安全除法，除数为0时结果为0"""
+    return (a / b.where(b != 0)).fillna(0.0)
+
+
+def pct_change_series(new, old):
+    """按列计算变化百分比，原值为0时结果为0"""
+    return ((new - old) / old.where(old != 0) * 100).fillna(0.0)
+
+
+def round_series(s, ndigits):
+    """按列保留小数，逐值结果与内置round一致（避免numpy舍入在.5附近的差异）"""
+    return pd.Series([round(v, ndigits) for v in s.astype(float).tolist()], index=s.index, dtype=float)
+
+
+def format_num_series(s):
+    """金额/数值按列保留2位小数"""
+    return round_series(s, 2)
+
+
+def format_pct_series(s, scale=100):
+    """按列生成保留1位小数的百分比文本（如"12.3%"），s为比例时scale=100，已是百分数时scale=1"""
+    return round_series(s * scale, 1).astype(str) + "%"
+
+
+def render_downstream_text(aff, old_label, new_label, is_drop):
+    """
+    批量生成Affiliate下游影响文本
+    参数：
+        aff: 每行一个Affiliate，含 affiliate 及 clicks/conversions/revenue/profit 的 _old/_new 两组列
+        old_label / new_label: 对比的两天日期（标量，或与aff同索引的Series）
+        is_drop: Offer整体是否利润下降（标量或Series），决定文案按下降还是上涨口径
+    返回：
+        与aff同索引的文本Series
+    场景：停止产生流水 / 增加产生流水 / 流水影响为主 / 利润率影响为主 / 二者共同影响
+    """
+    idx = aff.index
+    is_drop = pd.Series(is_drop, index=idx, dtype=bool)
+    old_label = pd.Series(old_label, index=idx).astype(str)
+    new_label = pd.Series(new_label, index=idx).astype(str)
+    name = aff["affiliate"].astype(str)
+
+    def num_text(s):
+        return format_num_series(s).astype(str)
+
+    # 与逐行版本一致：先保留2位小数，再用保留后的数值判断场景、拆解贡献
+    p_old = round_series(aff["profit_old"], 2)
+    p_new = round_series(aff["profit_new"], 2)
+    r_old = round_series(aff["revenue_old"], 2)
+    r_new = round_series(aff["revenue_new"], 2)
+
+    cr_old = safe_div_series(aff["conversions_old"], aff["clicks_old"])
+    cr_new = safe_div_series(aff["conversions_new"], aff["clicks_new"])
+    m_old = safe_div_series(aff["profit_old"], aff["revenue_old"])
+    m_new = safe_div_series(aff["profit_new"], aff["revenue_new"])
+
+    # 拆解影响因素：流水贡献 vs 利润率贡献（用保留2位小数后的流水，贡献也先保留2位小数再判断主导因素）
+    rev_contrib, margin_contrib, driver = decompose_profit_change(r_old, aff["profit_old"], r_new, aff["profit_new"], ndigits=2)
+    rev_contrib = pd.Series(rev_contrib, index=idx)
+    margin_contrib = pd.Series(margin_contrib, index=idx)
+
+    # 场景划分
+    stopped = is_drop & (p_new == 0) & (p_old != 0)
+    started = ~is_drop & (p_old == 0) & (p_new != 0)
+    rev_driven = driver == "流水"
+    margin_driven = driver == "利润率"
+    mixed = driver == "共同"
+
+    # 文本片段
+    p_old_t, p_new_t = p_old.astype(str), p_new.astype(str)
+    r_old_t, r_new_t = r_old.astype(str), r_new.astype(str)
+    c_old_t, c_new_t = num_text(aff["clicks_old"]), num_text(aff["clicks_new"])
+    cr_old_t, cr_new_t = format_pct_series(cr_old), format_pct_series(cr_new)
+    m_old_t, m_new_t = format_pct_series(m_old), format_pct_series(m_new)
+    rp = format_pct_series(pct_change_series(aff["revenue_new"], aff["revenue_old"]), scale=1)
+    cp = format_pct_series(pct_change_series(aff["clicks_new"], aff["clicks_old"]), scale=1)
+    crp = format_pct_series(pct_change_series(cr_new, cr_old), scale=1)
+    rc_t, mc_t = rev_contrib.astype(str), margin_contrib.astype(str)
+    apc_t = num_text(aff["profit_new"] - aff["profit_old"])  # Affiliate利润变化
+    trend = pd.Series(np.where(is_drop, "下降", "上涨"), index=idx)
+    margin_end = pd.Series(np.where(is_drop, "下降", "变化"), index=idx)
+    revenue_span = "对应Total revenue从 " + r_old_t + " 美金（" + old_label + "）变为 " + r_new_t + " 美金（" + new_label + "）"
+
+    stopped_txt = name + " 停止产生流水，减少流水 " + num_text(r_old - r_new) + " 美金，" + revenue_span
+    started_txt = name + " 增加产生流水，增加流水 " + num_text(r_new - r_old) + " 美金，" + revenue_span
+
+    base_txt = (name + " 的Total Profit影响 " + apc_t + " 美金，"
+                + "对应Total Profit从 " + p_old_t + " 美金（" + old_label + "）变为 " + p_new_t + " 美金（" + new_label + "）")
+    base_txt = base_txt + pd.Series(
+        np.where(is_drop, "", "，Total revenue从 " + r_old_t + " 美金（" + old_label + "）变为 " + r_new_t + " 美金（" + new_label + "）"),
+        index=idx
+    )
+
+    revenue_detail = ("Total revenue从 " + r_old_t + " 美金变为 " + r_new_t + " 美金，变化" + rp + "，"
+                      + "Total Clicks从 " + c_old_t + " 变为 " + c_new_t + "，变化" + cp + "，"
+                      + "CR从 " + cr_old_t + " 变为 " + cr_new_t + "，变化" + crp)
+    rev_txt = "，主要受流水" + trend + "影响，影响利润 " + rc_t + " 美金，" + revenue_detail
+    margin_txt = ("，主要受利润率" + trend + "影响，影响利润 " + mc_t + " 美金，"
+                  + "利润率从 " + m_old_t + " 变为 " + m_new_t + "，"
+                  + "请检查是否价格/预算设置发生改变，导致利润率" + margin_end)
+    mixed_txt = ("，流水和利润率分别影响 " + rc_t + " 美金和 " + mc_t + " 美金，" + revenue_detail + "，"
+                 + "同时利润率从 " + m_old_t + " 变为 " + m_new_t + "，"
+                 + "请检查是否价格/预算设置发生改变，导致利润率发生变化")
+    factor_txt = np.select([rev_driven, margin_driven, mixed], [rev_txt, margin_txt, mixed_txt], default="")
+
+    text = np.select([stopped, started], [stopped_txt, started_txt], default=base_txt + factor_txt)
+    return pd.Series(text, index=idx, dtype=object)
+
+
+def calculate_budget_fluctuation(sheets,offer_base_info):
+    """
+    预算日环比波动分析
+    参数：
+        sheets: 包含【1--过去30天总流水】的字典（key为sheet名，value为DataFrame）
+    返回：
+        result_df: 格式化后的预算波动分析结果DataFrame
+    """
+    # ======================
+    # 1. 数据预处理（基础兜底+标准化）
+    # ======================
+    # 只取本规则用到的流水列（Offer维度字段来自offer_base_info），不复制整张流水汇总
+    flow_cols = ["Offer ID", "Time", "Affiliate", "Total Clicks", "Total Conversions",
+                 "Total Revenue", "Total Profit", "Online hour"]
+    df = sheets["流水汇总"][[col for col in flow_cols if col in sheets["流水汇总"].columns]]
+
+    # 统一列名映射（适配不同命名）
+    rename_map = {
+        "Offer ID": "offerid",
+        "Adv Offer ID": "adv_offer_id",
+        "Advertiser": "advertiser",
+        "App ID": "appid",
+        "GEO": "country",
+        "Total Caps": "total_cap",
+        "Total Clicks": "clicks",
+        "Total Conversions": "conversions",
+        "Total Revenue": "revenue",
+        "Total Profit": "profit",
+        "Online hour": "online_hour",
+        "Status": "status",
+        "Affiliate": "affiliate",
+        "Time": "time"
+    }
+    df = df.rename(columns={k: v for k, v in rename_map.items() if k in df.columns})
+
+
+    # 数值字段兜底空值为0（核心：无利润也保留数据）
+    num_cols = ["clicks", "conversions", "revenue", "profit", "online_hour"]
+    df[num_cols] = df[num_cols].fillna(0).astype(float)
+
+
+    # 提取全局最新/次新日期
+    global_unique_dates = sorted(df["time"].unique(), reverse=True)
+    if len(global_unique_dates) < 2:
+        return pd.DataFrame()
+    day_new = global_unique_dates[0]          # 最新一天
+    day_old = global_unique_dates[1]          # 次新一天
+    day_new_str = str(day_new)
+    day_old_str = str(day_old)
+    day_7_ago = day_new - timedelta(days=7)
+
+    # ======================
+    # 2. Offer维度利润波动计算（含全量网格兜底）
+    # ======================
+    all_offer_ids = df["offerid"].unique().tolist()
+    offer_date_grid = pd.MultiIndex.from_product(
+        [all_offer_ids, [day_new, day_old]],
+        names=["offerid", "time"]
+    ).to_frame(index=False)
+
+    # Offer按日期聚合
+    offer_daily = df.groupby(["offerid", "time"], observed=True).agg({
+        "profit": "sum",
+        "revenue": "sum",
+        "online_hour": "max"
+    }).reset_index()
+
+    # 合并全量网格，无数据填充0
+    offer_full = pd.merge(
+        offer_date_grid,
+        offer_daily,
+        on=["offerid", "time"],
+        how="left"
+    ).fillna({
+        "profit": 0.0, "revenue": 0.0, "online_hour": 0.0
+    })
+
+    # 拆分最新/次新数据并合并
+    o_new = offer_full[offer_full["time"] == day_new].copy().reset_index(drop=True)
+    o_old = offer_full[offer_full["time"] == day_old].copy().reset_index(drop=True)
+    offer_merge = pd.merge(
+        o_new, o_old,
+        on="offerid",
+        suffixes=("_new", "_old"),
+        how="inner"
+    )
+
+    # 计算Offer利润变化，筛选波动≥10或≤-10美金的Offer
+    offer_merge["profit_change"] = offer_merge["profit_new"].astype(float) - offer_merge["profit_old"].astype(float)
+    fluctuated_offers = offer_merge[offer_merge["profit_change"].abs() >= 5.0].copy()
+
+    if fluctuated_offers.empty:
+        return pd.DataFrame()
+
+    # ======================
+    # 3. 所有波动Offer的Affiliate维度一次性计算（最新/次新两天对比）
+    # ======================
+    df_two_days = df[df["offerid"].isin(fluctuated_offers["offerid"]) & df["time"].isin([day_new, day_old])]
+    aff_daily = df_two_days.groupby(["offerid", "affiliate", "time"], observed=True).agg({
+        "clicks": "sum",
+        "conversions": "sum",
+        "revenue": "sum",
+        "profit": "sum",
+    })
+    # 按日期展开为 指标_new / 指标_old 两组列，某天无数据的Affiliate填充0
+    aff_merge = aff_daily.unstack("time").reindex(
+        columns=pd.MultiIndex.from_product([aff_daily.columns, [day_new, day_old]])
+    ).fillna(0.0)
+    aff_merge.columns = [f"{metric}_{'new' if day == day_new else 'old'}" for metric, day in aff_merge.columns]
+    aff_merge = aff_merge.reset_index()
+
+    # 计算Affiliate利润变化值（CR、利润率等在文本渲染阶段批量计算）
+    aff_merge["profit_change"] = aff_merge["profit_new"] - aff_merge["profit_old"]
+
+    # ======================
+    # 4. 核心逻辑：筛选影响的Affiliate
+    # 场景1：Offer利润下降≤-5美金 → 只关注利润也减少的Affiliate（profit_change≤-3）
+    # 场景2：Offer利润上涨≥5美金 → 只关注利润也增加的Affiliate（profit_change≥3）
+    # ======================
+    aff_merge = aff_merge.merge(
+        fluctuated_offers[["offerid", "profit_change"]].rename(columns={"profit_change": "offer_profit_change"}),
+        on="offerid",
+        how="inner"
+    )
+    is_drop = aff_merge["offer_profit_change"] <= -5.0
+    is_rise = aff_merge["offer_profit_change"] >= 5.0
+    aff_affect = aff_merge[
+        (is_drop & (aff_merge["profit_change"] <= -3.0)) |
+        (is_rise & (aff_merge["profit_change"] >= 3.0))
+    ]
+
+    # ======================
+    # 5. 生成下游影响文本
+    # ======================
+    downstream_by_offer = {}
+    if not aff_affect.empty:
+        downstream_by_offer = (
+            render_downstream_text(aff_affect, day_old_str, day_new_str, aff_affect["offer_profit_change"] <= -5.0)
+            .groupby(aff_affect["offerid"], sort=False)
+            .agg("\n".join)
+            .to_dict()
+        )
+
+    # 新/旧预算判断：Offer在30天内首次出现的日期
+    first_day_by_offer = df.groupby("offerid")["time"].min()
+
+    fluctuated_offers = fluctuated_offers.merge(
+        offer_dimension_by_id(offer_base_info),
+        on = 'offerid',
+        how='left')
+    
+    
+    target_col = 'Total Caps'
+
+    # 步骤1：尝试转换为数值类型，无法转换的变为NaN
+    fluctuated_offers[target_col] = pd.to_numeric(fluctuated_offers[target_col], errors='coerce')
+
+    # 步骤2：筛选条件：非数字(NaN) 或 数值≤0
+    condition = (fluctuated_offers[target_col].isna()) | (fluctuated_offers[target_col] <= 0)
+    
+    fluctuated_offers.loc[condition, target_col] = 100
+
+    offers = fluctuated_offers
+    offer_id = offers["offerid"]
+    profit_change_offer = offers["profit_change"].astype(float)  # Offer级利润变化
+    status_latest = offers["Status"]
+
+    # 无影响的Affiliate
+    downstream_final = offer_id.map(downstream_by_offer).fillna("无下游Affiliate有明显利润变化")
+
+    # ======================
+    # 6. 在线时长/预算状态总结
+    # ======================
+    oh_new = format_num_series(offers["online_hour_new"])
+    oh_old = format_num_series(offers["online_hour_old"])
+    oh_diff = format_num_series(offers["online_hour_new"].astype(float) - offers["online_hour_old"].astype(float))
+    oh_span = "（" + day_old_str + "：" + oh_old.astype(str) + "小时 → " + day_new_str + "：" + oh_new.astype(str) + "小时）"
+
+    is_active = status_latest == "ACTIVE"
+    status_summary = np.select(
+        [
+            status_latest == "PAUSE",
+            is_active & (oh_diff >= 0) & (profit_change_offer <= -10.0),
+            is_active & (oh_diff < -4) & (profit_change_offer <= -10.0),
+        ],
+        [
+            "预算已暂停，优先询问广告主预算暂停原因",
+            "在线时长无变化" + oh_span + "，但利润有明显下降，重点沟通影响下游",
+            "在线时长减少4小时以上" + oh_span + "，先和广告主沟通预算是否不足",
+        ],
+        default=""
+    )
+
+    # 新/旧预算判断
+    first_day = offer_id.map(first_day_by_offer).fillna(day_new)
+    budget_type = np.where(first_day >= day_7_ago, "新预算", "旧预算")
+
+    # ======================
+    # 7. 组装结果表（金额加美金）
+    # ======================
+    rows = pd.DataFrame({
+        "offer id": offer_id,
+        "adv offer id": offers["Adv Offer ID"],
+        "Advertiser": offers["Advertiser"],
+        "appid": offers["App ID"],
+        "country": offers["GEO"],
+        f"{day_new_str} Total cap": format_num_series(offers["Total Caps"]),
+        f"Payin": offers["Payin"],
+        f"{day_new_str} online hour（小时）": oh_new,
+        f"{day_old_str} online hour（小时）": oh_old,
+        f"{day_new_str} Total Revenue（美金）": format_num_series(offers["revenue_new"]),
+        f"{day_old_str} Total Revenue（美金）": format_num_series(offers["revenue_old"]),
+        f"{day_new_str} Total Profit（美金）": format_num_series(offers["profit_new"]),
+        f"{day_old_str} Total Profit（美金）": format_num_series(offers["profit_old"]),
+        f"{day_new_str} 利润率": format_pct_series(safe_div_series(offers["profit_new"], offers["revenue_new"])),
+        f"{day_old_str} 利润率": format_pct_series(safe_div_series(offers["profit_old"], offers["revenue_old"])),
+        f"Total Profit变化差值（{day_new_str}-{day_old_str}）（美金）": format_num_series(profit_change_offer),
+        f"online hour变化差值（{day_new_str}-{day_old_str}）（小时）": oh_diff,
+        "预算status状态": status_latest,
+        "在线时长和预算状态总结": status_summary,
+        "具体影响下游总结": downstream_final,
+        "预算类型": budget_type
+    }).reset_index(drop=True)
+
+    # ======================
+    # 8. 结果格式化
+    # ======================
+    # 列类型与逐行组装时一致（object列按实际取值推断）
+    result_df = rows.infer_objects()
+    # 确保数值列类型正确
+    for col in result_df.columns:
+        if "%" in col or "总结" in col or "类型" in col or "状态" in col or "offer id" in col:
+            continue
+        result_df[col] = pd.to_numeric(result_df[col], errors="ignore")
+
+
+    return result_df
+
+
+
+def calculate_reject_data(sheets):
+    """规则3：计算reject数据（在event汇总上匹配是否为reject和广告主，每行带该组合的"事件数"）"""
+    event_df = sheets["event汇总"].copy()
+    reject_rule_df = sheets["reject规则"].copy()
+    adv_match_df = sheets["广告主匹配"].copy()
+    
+    # 步骤a：匹配是否为reject
+    event_df = pd.merge(
+        event_df,
+        reject_rule_df[["Event", "是否为reject"]],
+        on="Event",
+        how="left"
+    ).fillna({"是否为reject": False})
+    
+    # 步骤b：匹配二级/三级广告主
+    event_df = pd.merge(
+        event_df,
+        adv_match_df[["Advertiser", "二级广告主", "三级广告主"]],
+        left_on="Advertiser",
+        right_on="Advertiser",
+        how="left"
+    )
+
+    
+    # 步骤c：调整Appnext的Time字段
+    event_df.loc[(event_df["是否为reject"] == True) & (event_df["三级广告主"] == "Appnext"), "Time"] -= timedelta(days=1)
+    
+    return event_df
+
+def calculate_advertiser_data(sheets, date_new, date_old, rollup):
+    """规则4：计算Advertiser数据（从最新两天汇总表取二级广告主层级）"""
+    final_adv = rollup_level(rollup, "二级广告主")
+    final_adv = final_adv.rename(columns={
+        "Revenue 变化幅度": "Total Revenue 变化幅度",
+        "Profit 变化幅度": "Total Profit 变化幅度"
+    })
+    final_adv = final_adv.rename(columns=two_day_column_names(date_new, date_old))
+    
+    return final_adv.fillna(0)
+
+def calculate_dimension_data(sheets, date_new, date_old, reject_event_df, dims):
+    """按任意维度计算最新两天对比（DIMENSION_COMPARE_SHEETS中的GEO、App ID等），列名同Advertiser数据"""
+    final_dim = compare_two_days(sheets, dims, date_new, date_old, reject_event_df)
+    final_dim = final_dim.rename(columns={
+        "Revenue 变化幅度": "Total Revenue 变化幅度",
+        "Profit 变化幅度": "Total Profit 变化幅度"
+    })
+    final_dim = final_dim.rename(columns=two_day_column_names(date_new, date_old))
+
+    return final_dim.fillna(0)
+
+def calculate_affiliate_data(sheets, date_new, date_old, rollup):
+    """规则5：计算Affiliate数据（从最新两天汇总表取Affiliate层级）"""
+    final_aff = rollup_level(rollup, "Affiliate")
+    final_aff = final_aff.rename(columns={
+        "Revenue 变化幅度": "Revenue 变化幅度(%)",
+        "Profit 变化幅度": "Profit 变化幅度(%)",
+        "利润率 变化幅度": "利润率 变化幅度(%)"
+    })
+    final_aff = final_aff.rename(columns=two_day_column_names(date_new, date_old))
+    
+    return final_aff.fillna(0)
+
+
+def calculate_large_drop_budget(sheets,offer_base_info):
+    """
+    规则6：计算上周四到今天利润下降幅度较大的预算
+    参数：
+        sheets: 包含【1--过去30天总流水】的字典（key为sheet名，value为DataFrame）
+    返回：
+        result_df: 包含所有要求字段的利润下降预算分析结果
+    """
+    # ======================
+    # 1. 数据预处理
+    # ======================
+    # 只取本规则用到的流水列（Offer维度字段来自offer_base_info），不复制整张流水汇总
+    flow_cols = ["Offer ID", "Time", "Affiliate", "Status", "Total Clicks", "Total Conversions",
+                 "Total Revenue", "Total Profit", "Online hour"]
+    df = sheets["流水汇总"][[col for col in flow_cols if col in sheets["流水汇总"].columns]]
+    # 统一列名映射
+    rename_map = {
+        "Offer ID": "offerid",
+        "Adv Offer ID": "adv_offer_id",
+        "Advertiser": "advertiser",
+        "App ID": "appid",
+        "GEO": "country",
+        "Total Caps": "total_cap",
+        "Total Clicks": "clicks",
+        "Total Conversions": "conversions",
+        "Total Revenue": "revenue",
+        "Total Profit": "profit",
+        "Online hour": "online_hour",
+        "Status": "status",
+        "Affiliate": "affiliate",
+        "Time": "date"
+    }
+    df = df.rename(columns={k: v for k, v in rename_map.items() if k in df.columns})
+    
+    
+    # 日期处理：转为date格式，提取关键时间节点
+    today = datetime.now().date()  # 今天
+    monday_of_this_week = today - timedelta(days=today.weekday())
+    last_thursday = monday_of_this_week - timedelta(days=4)
+
+    latest_date = df["date"].max()  # 数据中最新一天
+    penultimate_date = sorted(df["date"].unique())[-2] if len(df["date"].unique()) >=2 else latest_date  # 次次新一天
+    
+    # 数值字段兜底空值为0
+    num_cols = ["clicks", "conversions", "revenue", "profit", "online_hour"]
+    df[num_cols] = df[num_cols].fillna(0).astype(float)
+    
+    # ======================
+    # 2. 找到每个offerid的历史最高利润日（上周四到次次新）
+    # ======================
+    # 按offerid+date聚合30天日度数据（历史最高日和最新一天共用这一张表）
+    offer_daily = decategorize_frame(df.groupby(["offerid", "date"], observed=True).agg({
+        "profit": "sum",
+        "revenue": "sum",
+        "online_hour": "max",
+        "status": "first"
+    }).reset_index())
+    
+    # 筛选时间范围：上周四到次次新
+    time_range = (offer_daily["date"] >= last_thursday) & (offer_daily["date"] < penultimate_date)
+    window_daily = offer_daily[time_range]
+    
+    # 历史最高利润索引：按日期顺序累计每个offerid截至当天的最高利润，
+    # 利润严格创新高的那天记为新的最高日（并列时保留最早一天，与idxmax一致）
+    window_offer = window_daily["offerid"]
+    prev_max = window_daily.groupby("offerid")["profit"].cummax().groupby(window_offer).shift()
+    is_new_high = prev_max.isna() | (window_daily["profit"] > prev_max)
+    max_idx = window_daily.index.to_series().where(is_new_high).groupby(window_offer).last()
+    
+    offer_max_profit = offer_daily.loc[max_idx.astype(int)].rename(columns={
+        "profit": "max_profit",
+        "revenue": "max_revenue",
+        "online_hour": "max_online_hour",
+        "date": "max_profit_date",
+        "status": "max_status"
+    })
+    
+    # ======================
+    # 3. 提取每个offerid最新一天的数据
+    # ======================
+    latest_data = offer_daily[offer_daily["date"] == latest_date].drop(columns="date").rename(columns={
+        "profit": "latest_profit",
+        "revenue": "latest_revenue",
+        "online_hour": "latest_online_hour",
+        "status": "latest_status"
+    })
+    
+    # ======================
+    # 4. 合并数据，筛选利润下降的offerid（核心修复：新增历史有利润/最新无利润的条件）
+    # ======================
+    offer_merge = pd.merge(
+        offer_max_profit[["offerid", "max_profit", "max_revenue", "max_online_hour", "max_profit_date", "max_status"]],
+        latest_data,
+        on="offerid",
+        how="outer"  # 关键修改：inner -> outer
+    )
+    
+    # 可选：填充缺失值（推荐，避免后续分析出现NaN问题）
+    # 数值型字段填充为0，字符串/状态字段填充为特定标识
+    offer_merge = offer_merge.fillna({
+        "max_profit": 0,
+        "max_revenue": 0,
+        "max_online_hour": 0,
+        "latest_profit": 0,
+        "latest_revenue": 0,
+        "latest_online_hour": 0,
+        "max_status": "未知",
+        "latest_status": "未知"
+    })
+    
+    # 计算利润差值
+    offer_merge["profit_diff"] = offer_merge["latest_profit"] - offer_merge["max_profit"]
+    
+    # 核心筛选条件（修复后）：
+    # 条件1：利润差值 ≤ -10 美金（原有）
+    condition1 = offer_merge["profit_diff"] <= -5.0
+   
+    drop_offers = offer_merge[condition1].copy()
+    
+    # 对条件2的offerid，重新计算profit_diff（确保文本逻辑兼容）
+ 
+    
+ 
+    
+    if drop_offers.empty:
+        return pd.DataFrame()
+    
+    offer_dim = offer_dimension_by_id(offer_base_info)
+    
+    drop_offers = drop_offers.merge(offer_dim[['offerid','Adv Offer ID','App ID','Advertiser', "GEO",'Total Caps', 'Status', 'Payin']],
+        on = 'offerid',
+        how='left')
+
+
+    
+    target_col = 'Total Caps'
+
+    # 步骤1：尝试转换为数值类型，无法转换的变为NaN
+    drop_offers[target_col] = pd.to_numeric(drop_offers[target_col], errors='coerce')
+
+    # 步骤2：筛选条件：非数字(NaN) 或 数值≤0
+    condition = (drop_offers[target_col].isna()) | (drop_offers[target_col] <= 0)
+    
+    drop_offers.loc[condition, target_col] = 100   
+    
+    
+    # ======================
+    # 5. 一次性计算所有下降offerid的Affiliate维度数据
+    # ======================
+    drop_ids = drop_offers["offerid"]
+    df_drop = df[df["offerid"].isin(drop_ids)]
+    
+    # 每个offerid最早产生流水的日期（用于新/旧预算标记）
+    first_revenue_dates = df_drop[df_drop["revenue"] > 0].groupby("offerid")["date"].min()
+    offers_with_data = set(df_drop["offerid"].unique())
+    
+    # ======================
+    # 5.1 按offerid+Affiliate汇总历史最高日和最新日数据
+    # ======================
+    aff_cols = ["clicks", "conversions", "revenue", "profit"]
+    df_drop = df_drop.merge(drop_offers[["offerid", "max_profit_date"]], on="offerid", how="left")
+    aff_max = df_drop[df_drop["date"] == df_drop["max_profit_date"]].groupby(["offerid", "affiliate"], observed=True)[aff_cols].sum()
+    aff_latest = df_drop[df_drop["date"] == latest_date].groupby(["offerid", "affiliate"], observed=True)[aff_cols].sum()
+    
+    # 合并Affiliate数据，无数据填充0
+    aff_merge = aff_max.add_suffix("_max").join(
+        aff_latest.add_suffix("_latest"), how="outer"
+    ).fillna(0.0).sort_index().reset_index()
+    
+    # 计算Affiliate利润变化值
+    aff_merge["profit_change"] = aff_merge["profit_latest"] - aff_merge["profit_max"]
+    
+    # ======================
+    # 5.2 筛选影响的Affiliate（利润变化≤-3美金），批量生成下游影响文本
+    # ======================
+    aff_affect = aff_merge[aff_merge["profit_change"] <= -3.0]
+    downstream_map = {}
+    if not aff_affect.empty:
+        aff_text = render_downstream_text(
+            aff_affect.rename(columns=lambda c: c.replace("_max", "_old").replace("_latest", "_new")),
+            aff_affect["offerid"].map(drop_offers.set_index("offerid")["max_profit_date"]),
+            latest_date,
+            True
+        )
+        downstream_map = aff_text.groupby(aff_affect["offerid"], sort=False).agg("; \n".join).to_dict()
+    
+    # ======================
+    # 5.3 按列组装所有下降offerid的结果
+    # ======================
+    offers = drop_offers
+    offer_id = offers["offerid"]
+    profit_diff = offers["profit_diff"]  # 最新-历史最高 利润差值
+    latest_status = offers["Status"]
+
+    # 历史最高利润日 / 最新一天的在线时长（保留2位小数后再比较和拼接）
+    max_online_hour = format_num_series(offers["max_online_hour"])
+    latest_online_hour = format_num_series(offers["latest_online_hour"])
+    oh_diff_float = latest_online_hour - max_online_hour
+
+    # 处理下游文本：无变化/多Affiliate分隔（; + 换行）
+    downstream_final = offer_id.map(downstream_map).fillna("无下游有明显变化")
+
+    # 生成在线时长和预算状态总结
+    oh_span = ("（" + offers["max_profit_date"].astype(str) + "：" + max_online_hour.astype(str) + "小时 → "
+               + str(latest_date) + "：" + latest_online_hour.astype(str) + "小时）")
+    is_active = latest_status == "ACTIVE"
+    status_summary = np.select(
+        [
+            latest_status == "PAUSE",
+            is_active & (oh_diff_float >= 0) & (profit_diff <= -10.0),
+            is_active & (oh_diff_float < -4) & (profit_diff <= -10.0),
+        ],
+        [
+            "预算已暂停，优先询问广告主预算暂停原因",
+            "在线时长无变化" + oh_span + "，但利润有明显下降，重点沟通影响下游",
+            "在线时长减少4小时以上" + oh_span + "，先和广告主沟通预算是否不足，因为预算在线时长较短",
+        ],
+        default=""
+    )
+
+    # 标记新/旧预算（近7天首次产生流水）
+    first_revenue_date = offer_id.map(first_revenue_dates)
+    is_new_budget = (offer_id.isin(offers_with_data) & first_revenue_date.notna()
+                     & (first_revenue_date >= (latest_date - timedelta(days=7))))
+    budget_type = np.where(is_new_budget, "新预算", "旧预算")
+
+    rows = pd.DataFrame({
+        "offer id": offer_id,
+        "adv offer id": offers["Adv Offer ID"],
+        "Advertiser": offers["Advertiser"],
+        "appid": offers["App ID"],
+        "country": offers["GEO"],
+        "昨日Total cap": format_num_series(offers["Total Caps"]),
+        "Payin": offers["Payin"],
+        "昨日online hour（小时）": latest_online_hour,
+        "历史最高利润对应日期": offers["max_profit_date"],
+        "历史最高利润当天online hour（小时）": max_online_hour,
+        "昨日Total revenue（美金）": format_num_series(offers["latest_revenue"]),
+        "历史最高利润当天Total revenue（美金）": format_num_series(offers["max_revenue"]),
+        "昨日Total profit（美金）": format_num_series(offers["latest_profit"]),
+        "历史最高利润当天profit一天Total profit（美金）": format_num_series(offers["max_profit"]),
+        "昨日利润率": format_pct_series(safe_div_series(offers["latest_profit"], offers["latest_revenue"])),
+        "历史最高利润当天利润率": format_pct_series(safe_div_series(offers["max_profit"], offers["max_revenue"])),
+        "Total profit变化差值（美金）": format_num_series(profit_diff),
+        "online hour变化差值（小时）": format_num_series(oh_diff_float),
+        "预算status状态": latest_status,
+        "在线时长和预算状态总结": status_summary,
+        "具体影响下游总结": downstream_final,
+        "预算类型": budget_type
+    }).reset_index(drop=True)
+    
+    
+    # ======================
+    # 6. 结果格式化输出
+    # ======================
+    # 列类型与逐行组装时一致（object列按实际取值推断）
+    result_df = rows.infer_objects()
+    # 确保数值列类型正确
+    for col in result_df.columns:
+        if "%" in col or "总结" in col or "类型" in col or "状态" in col or "offer id" in col:
+            continue
+        result_df[col] = pd.to_numeric(result_df[col], errors="ignore")
+    
+    return result_df
+
+
+def calculate_profit_influence(sheets, date_new, date_old):
+    """规则7：计算利润影响因素（最终优化版）
+    新增核心逻辑：利润变化绝对值百分比<5% → 视为稳定，不执行offer+affiliate深度分析
+    """
+    # 格式化日期字符串
+    date_new_str = date_new
+    date_old_str = date_old
+    
+    # ---------------------- 1. 全局利润/流水/利润率计算 ----------------------
+    # 筛选最近两天数据（先筛选再改列，不复制整张流水汇总），使用加载时已转为字符串的Offer Id
+    flow_df = sheets["流水汇总"]
+    flow_recent = decategorize_frame(flow_df[flow_df["Time"].isin([date_new, date_old])].drop(columns="Offer ID").rename(
+        columns={"Offer Id": "Offer ID"}
+    ))
+    flow_recent["Affiliate"] = flow_recent["Affiliate"].fillna("未知Affiliate")  # 兜底空值
+    
+    # 全局汇总（最近两天）
+    total_summary = flow_recent.groupby("Time").agg({
+        "Total Revenue": "sum",
+        "Total Profit": "sum"
+    }).reset_index()
+    
+    # 拆分新/旧数据（兜底空数据）
+    total_new = total_summary[total_summary["Time"] == date_new].iloc[0] if not total_summary[total_summary["Time"] == date_new].empty else pd.Series([0, 0], index=["Total Revenue", "Total Profit"])
+    total_old = total_summary[total_summary["Time"] == date_old].iloc[0] if not total_summary[total_summary["Time"] == date_old].empty else pd.Series([0, 0], index=["Total Revenue", "Total Profit"])
+    
+    # 基础指标（全局）
+    rev_new = total_new["Total Revenue"]
+    rev_old = total_old["Total Revenue"]
+    profit_new = total_new["Total Profit"]
+    profit_old = total_old["Total Profit"]
+    
+    # 全局利润率（避免除以0）
+    profit_margin_new = profit_new / rev_new if rev_new != 0 else np.nan
+    profit_margin_old = profit_old / rev_old if rev_old != 0 else np.nan
+    
+    # 环比计算（全局）
+    rev_abs_change = rev_new - rev_old  # 流水绝对值变化
+    rev_pct_change = (rev_abs_change / rev_old) * 100 if rev_old != 0 else np.nan
+    profit_abs_change = profit_new - profit_old  # 利润绝对值变化
+    profit_pct_change = (profit_abs_change / profit_old) * 100 if profit_old != 0 else np.nan
+    margin_abs_change = profit_margin_new - profit_margin_old  # 利润率绝对值变化
+    margin_pct_change = (margin_abs_change / profit_margin_old) * 100 if profit_margin_old != 0 else np.nan
+    
+    # ---------------------- 2. 核心判断：利润波动是否≥5%（新增关键逻辑） ----------------------
+    # 计算利润变化绝对值百分比（兜底NaN情况）
+    profit_fluctuation_pct = abs(profit_pct_change) if not np.isnan(profit_pct_change) else 0
+    # 判定是否稳定：<5% → 稳定，≥5% → 需分析
+    is_profit_stable = profit_fluctuation_pct < 5.0
+    
+    # ---------------------- 3. 仅当利润不稳定时，计算全局贡献度+驱动因素 ----------------------
+    influence_type = ""
+    factor_text = ""
+    revenue_contribution = 0
+    margin_contribution = 0
+    total_contribution = 0
+    profit_trend = "持平"
+    
+    if not is_profit_stable:
+        # 全局贡献度（流水/利润率对利润变化的影响）及核心驱动因素（流水/利润率/共同，利润无变化时为无）
+        contributions = decompose_profit_change(rev_old, profit_old, rev_new, profit_new, missing_margin=None, net_total=True)
+        revenue_contribution, margin_contribution, influence_type = (values.item() for values in contributions)
+        factor_text = PROFIT_DRIVER_TEXT[influence_type]
+        
+        # 利润涨跌方向
+        profit_trend = "上涨" if profit_abs_change > 0 else "下降" if profit_abs_change < 0 else "持平"
+    
+    # ---------------------- 4. 仅当利润不稳定时，执行offer+affiliate深度分析 ----------------------
+    offer_texts = []
+    if not is_profit_stable and profit_trend != "持平" and influence_type != "无":
+        # 3.1 先按offer_id+Time聚合（基础信息+整体指标）
+        offer_static = flow_recent.groupby("Offer ID").agg({
+        "Advertiser": "first",  # 一个Offer只有一个Advertiser，直接取第一个
+        "Adv Offer ID": "first",
+        "App ID": "first",
+        "GEO": "first"
+       }).reset_index()  # 重置索引，方便后续合并
+        
+        offer_dynamic = flow_recent.groupby(["Offer ID", "Time"]).agg({
+        "Total Revenue": "sum",
+        "Total Profit": "sum"}).unstack().fillna(0)  # 只对动态指标unstack
+        
+        offer_dynamic.columns = [f"{col[0]}_{col[1].strftime('%Y-%m-%d')}" for col in offer_dynamic.columns]
+        offer_dynamic = offer_dynamic.reset_index()  # 重置索引，Offer ID变为列
+        
+    
+        offer_base = pd.merge(
+        offer_static,
+        offer_dynamic,
+        on="Offer ID",
+        how="inner" )  # 只保留有动态指标的Offer
+  
+    
+        
+        # 整理列名（统一新/旧命名）
+        cols = offer_base.columns
+        date_cols = [date_old_str, date_new_str] 
+        
+        offer_base.rename(columns={
+            f"Total Revenue_{date_old_str}": "old_Revenue",
+            f"Total Revenue_{date_new_str}": "new_Revenue",
+            f"Total Profit_{date_old_str}": "old_Profit",
+            f"Total Profit_{date_new_str}": "new_Profit"
+        }, inplace=True)
+        
+        # 3.2 计算offer级核心指标
+        offer_base["offer_profit_change"] = offer_base["new_Profit"] - offer_base["old_Profit"]  # offer总利润变化
+        # offer级流水/利润率分项影响（任一天流水为0时利润率影响为0）
+        offer_base["revenue_driven_change"], offer_base["margin_driven_change"], _ = decompose_profit_change(
+            offer_base["old_Revenue"], offer_base["old_Profit"], offer_base["new_Revenue"], offer_base["new_Profit"],
+            missing_margin=None
+        )
+        
+        # 3.3 按利润涨跌方向排序（offer级）
+        if profit_trend == "下降":
+            offer_sorted = offer_base.sort_values("offer_profit_change", ascending=True)  # 下降升序
+            sort_desc = "升序"
+        else:
+            offer_sorted = offer_base.sort_values("offer_profit_change", ascending=False)  # 上涨降序
+            sort_desc = "降序"
+        
+        # 3.4 筛选利润绝对值变化超过10美金的核心offer
+        total_offer_change = offer_sorted["offer_profit_change"].sum()
+        if abs(total_offer_change) < 1e-6:
+            top_offers = pd.DataFrame()
+        else:
+            offer_sorted["cumulative_change"] = offer_sorted["offer_profit_change"].cumsum()
+            offer_sorted["cumulative_ratio"] = (offer_sorted["cumulative_change"] / total_offer_change * 100)
+            #top_offers = offer_sorted[offer_sorted["cumulative_ratio"] <= 80.0].copy()
+            if profit_trend == "下降":
+                top_offers = offer_sorted[offer_sorted["revenue_driven_change"] <- 10.0].copy()
+            else:
+                top_offers = offer_sorted[offer_sorted["revenue_driven_change"] >= 10.0].copy()
+            # 兜底：无满足条件时取累计最接近的前10个
+            if top_offers.empty:
+                offer_sorted["cumulative_ratio"] = offer_sorted["cumulative_change"].abs().cumsum() / abs(total_offer_change) * 100
+                top_offers = offer_sorted[offer_sorted["cumulative_ratio"] <= 80.0].head(10)
+        
+        # 3.5 拆解核心offer的affiliate维度影响：一次分组得到全部核心offer的affiliate利润变化，再按offer合并文本
+        if not top_offers.empty:
+            core_offer_ids = top_offers['Offer ID'].tolist()  # 核心offer列表
+            # 筛选核心offer的affiliate数据
+            aff_data = flow_recent[flow_recent["Offer ID"].isin(core_offer_ids)].copy()
+            
+            # 按offer_id+Affiliate+Time聚合affiliate级数据（按Offer ID、Affiliate排序）
+            aff_base = aff_data.groupby(["Offer ID", "Affiliate", "Time"]).agg({
+                "Total Profit": "sum"
+            }).unstack().fillna(0)
+            aff_base.columns = [f"{date_old_str}_Profit", f"{date_new_str}_Profit"] if date_old in aff_base.columns.levels[1] else [f"{date_new_str}_Profit", f"{date_old_str}_Profit"]
+            aff_base.rename(columns={
+                f"{date_old_str}_Profit": "old_aff_Profit",
+                f"{date_new_str}_Profit": "new_aff_Profit"
+            }, inplace=True)
+            # 计算每个affiliate的利润变化
+            aff_base["aff_profit_change"] = aff_base["new_aff_Profit"] - aff_base["old_aff_Profit"]
+            aff_base.reset_index(inplace=True)
+            
+            # 每个affiliate一段文本，同一offer的按Affiliate顺序合并
+            aff_base["aff_text"] = (aff_base["Affiliate"].astype(str)
+                                    + "（影响利润" + aff_base["aff_profit_change"].map("{:.2f}".format) + "美金）")
+            offer_aff_texts = top_offers["Offer ID"].map(aff_base.groupby("Offer ID")["aff_text"].agg("; ".join))
+            
+            # 核心offer文本（按排序后的顺序），有affiliate数据的再拼接affiliate影响
+            offer_text = (
+                "Offer ID：" + top_offers["Offer ID"].astype(str)
+                + "（广告主：" + top_offers["Advertiser"].astype(str)
+                + "，Adv Offer ID：" + top_offers["Adv Offer ID"].astype(str)
+                + "，App ID：" + top_offers["App ID"].astype(str)
+                + "，GEO：" + top_offers["GEO"].astype(str) + "），"
+                + "影响利润" + top_offers["offer_profit_change"].map("{:.2f}".format)
+                + "美金（流水影响" + top_offers["revenue_driven_change"].map("{:.2f}".format)
+                + "美金，利润率影响" + top_offers["margin_driven_change"].map("{:.2f}".format) + "美金）"
+            )
+            offer_text = offer_text.where(
+                offer_aff_texts.isna(), offer_text + "；该Offer下核心Affiliate影响：" + offer_aff_texts
+            )
+            offer_texts = offer_text.tolist()
+    
+    # ---------------------- 5. 生成最终结论文本 ----------------------
+    # 基础结论
+    base_conclusion = (
+        f"昨日流水(Total revenue){rev_new:.2f}美金（{date_new_str}），环比{date_old_str}变化{rev_pct_change:.1f}%（绝对值变化{rev_abs_change:.2f}美金），"
+        f"利润{profit_new:.2f}美金，环比{date_old_str}变化{profit_pct_change:.1f}%（绝对值变化{profit_abs_change:.2f}美金），"
+        f"利润率(Total profit/Total revenue){profit_margin_new:.4f}，环比{date_old_str}变化{margin_pct_change:.1f}%（绝对值变化{margin_abs_change:.4f}）"
+    )
+    
+    # 分场景生成结论
+    if is_profit_stable:
+        # 场景1：利润稳定（波动<5%）→ 仅输出稳定结论
+        final_conclusion = f"{base_conclusion}，利润变化幅度{profit_fluctuation_pct:.1f}%<5%，利润整体稳定，无需进一步分析。"
+    else:
+        # 场景2：利润不稳定（波动≥5%）→ 输出完整分析
+        # 核心驱动因素结论
+        driver_conclusion = (
+            f"；其中利润变化受流水变化影响{revenue_contribution:.2f}美金，受利润率变化影响{margin_contribution:.2f}美金；"
+            f"近两日（{date_old_str}至{date_new_str}）利润{profit_trend}，主要由{factor_text}驱动"
+        )
+        
+        # offer+affiliate维度分析结论
+        if offer_texts:
+            offer_conclusion = f"；累计贡献利润{profit_trend}幅度≥80%的核心Offer如下（按{sort_desc}排序）：{'; '.join(offer_texts)}"
+        else:
+            offer_conclusion = "；未找到累计贡献利润变化≥80%的核心Offer"
+        
+        # 拼接最终结论
+        final_conclusion = base_conclusion + driver_conclusion + offer_conclusion + "。"
+    
+    return final_conclusion
+
+
+
+def extract_offer_ids(offer_names):
+    """从Offer Name的 [数字] 中提取Offer Id（字符串，没有匹配时为空字符串，空值按"nan"处理同样为空字符串）
+    Offer Name重复度很高，只对去重后的名称做一次向量化正则提取，再按编码映射回每一行
+    """
+    codes, uniques = pd.factorize(offer_names)
+    offer_ids = pd.Series(uniques, dtype=object).astype(str).str.extract(r"\[(\d+)\]", expand=False).fillna("")
+    # factorize把空值编码为-1，对应末尾追加的空字符串
+    return pd.Series(np.append(offer_ids.to_numpy(dtype=object), "")[codes], index=offer_names.index, dtype=object)
+
+
+def calculate_event_analysis(sheets, offer_base_info, reject_event_df):
+    """计算event事件分析（单独输出Excel）
+    reject_event_df为calculate_reject_data的结果（已匹配是否为reject、广告主信息并调整Appnext时间），不再重复匹配
+    """
+    flow_df = sheets["流水汇总"]
+
+    # 预处理：去除Event为空的数据（Offer Id已在汇总event时从Offer Name中提取）
+    event_df = reject_event_df[reject_event_df["Event"].notna()]
+    
+    # 1、计算event--reject事件
+    reject_event = event_df[event_df["是否为reject"] == True].copy()
+    
+    # 步骤f：计算总体reject rate
+
+
+    # 流水汇总的Offer Id加载时已是字符串，与event中提取的Offer Id直接关联
+    flow_conv = decategorize_frame(flow_df.groupby(["Time", "Offer Id", "Advertiser", "App ID", "GEO"], observed=True).agg({
+        "Total Conversions": "sum"
+    }).reset_index())
+    
+    
+    
+    reject_total = reject_event.groupby(["Time", "Offer Id"]).agg({
+        "事件数": "sum"
+    }).reset_index().rename(columns={"事件数": "Total reject"})
+    
+    reject_rate_total = pd.merge(reject_total, flow_conv, on=["Time", "Offer Id"], how="left").fillna(0)
+    reject_rate_total["reject rate"] = reject_rate_total["Total reject"] / (reject_rate_total["Total reject"] + reject_rate_total["Total Conversions"]).replace(0, np.nan)
+    
+    # 步骤d：计算每个affiliate的reject rate
+    reject_affiliate = reject_event.groupby(["Time", "Offer Id", "Affiliate"]).agg({
+        "事件数": "sum"
+    }).reset_index().rename(columns={"事件数": "Total reject"})
+    
+    flow_conv_aff = decategorize_frame(flow_df.groupby(["Time", "Offer Id", "Advertiser", "Affiliate", "App ID", "GEO"], observed=True).agg({
+        "Total Conversions": "sum"
+    }).reset_index())
+
+    reject_rate_affiliate = pd.merge(reject_affiliate, flow_conv_aff, on=["Time", "Offer Id", "Affiliate"], how="left").fillna(0)
+    reject_rate_affiliate["reject rate"] = reject_rate_affiliate["Total reject"] / (reject_rate_affiliate["Total reject"] + reject_rate_affiliate["Total Conversions"]).replace(0, np.nan)
+    
+    
+
+    # 匹配总体reject rate
+    reject_rate_affiliate = pd.merge(
+        reject_rate_affiliate,
+        reject_rate_total[["Time", "Offer Id", "reject rate"]].rename(columns={"reject rate": "总体 reject rate"}),
+        on=["Time", "Offer Id"],
+        how="left"
+    )
+    
+    
+    # 2、计算非reject事件（核心修正：将 == False 改为 != True）
+    non_reject_event = event_df[event_df["是否为reject"] != True].copy()
+    
+    # 步骤f：计算总体event rate
+    non_reject_total = non_reject_event.groupby(["Time", "Offer Id", "Event"], observed=True).agg({
+        "事件数": "sum"
+    }).reset_index().rename(columns={"事件数": "Total event"})
+    
+
+    
+    
+    
+    event_rate_total = pd.merge(non_reject_total, flow_conv, on=["Time", "Offer Id"], how="left").fillna(0)
+    event_rate_total["event rate"] = event_rate_total["Total event"] / ( event_rate_total["Total Conversions"]).replace(0, np.nan)
+    
+    # 步骤d：计算每个affiliate的event rate
+    non_reject_affiliate_event = event_df[event_df["是否为reject"] != True].copy()
+    non_reject_affiliate = non_reject_affiliate_event.groupby(["Time", "Offer Id", "Affiliate", "Event"], observed=True).agg({
+        "事件数": "sum"
+    }).reset_index().rename(columns={"事件数": "Total event"})
+
+    event_rate_affiliate = pd.merge(non_reject_affiliate, flow_conv_aff, on=["Time", "Offer Id", "Affiliate"], how="left").fillna(0)
+    event_rate_affiliate["event rate"] = event_rate_affiliate["Total event"] / (event_rate_affiliate["Total Conversions"]).replace(0, np.nan)
+    
+    # 匹配总体event rate
+    event_rate_affiliate = pd.merge(
+        event_rate_affiliate,
+        event_rate_total[["Time", "Offer Id", "Event", "event rate"]].rename(columns={"event rate": "总体 event rate"}),
+        on=["Time", "Offer Id", "Event"],
+        how="left"
+    )
+    
+    cols_to_replace = ['GEO', 'App ID', 'Advertiser']
+    
+    offer_base_info_cols = ['Offer Id'] + cols_to_replace +['Adv Offer ID']
+    
+    reject_rate_affiliate = reject_rate_affiliate.merge(
+    offer_base_info[offer_base_info_cols],
+    on=['Offer Id'],  # 指定共同匹配字段
+    how='left',  # 左连接：保留df_a的所有行
+    suffixes=('', '_offer_base_info'))
+    
+    event_rate_affiliate = event_rate_affiliate.merge(
+    offer_base_info[offer_base_info_cols],
+    on=['Offer Id'],  # 指定共同匹配字段
+    how='left',  # 左连接：保留df_a的所有行
+    suffixes=('', '_offer_base_info'))  # 原列名不加后缀，b的列加_b后缀
+    
+    
+    for col in cols_to_replace:
+
+        event_rate_affiliate[col] = event_rate_affiliate[f'{col}_offer_base_info'].fillna(event_rate_affiliate[col])
+        reject_rate_affiliate[col] = reject_rate_affiliate[f'{col}_offer_base_info'].fillna(reject_rate_affiliate[col])      
+
+    reject_rate_affiliate = reject_rate_affiliate.drop(columns=[f'{col}_offer_base_info' for col in cols_to_replace])    
+    event_rate_affiliate = event_rate_affiliate.drop(columns=[f'{col}_offer_base_info' for col in cols_to_replace])
+    
+    
+  
+    
+    return reject_rate_affiliate, event_rate_affiliate
+
+
+
+def calculate_budget_rules(sheets,offer_base_info):
+      
+    
+    # 浅拷贝：下面只改列名、新增列，不修改共享流水汇总的数据
+    df_30d_flow = sheets['流水汇总'].copy(deep=False)
+    
+    df_reject_rule = sheets['reject规则'].copy()
+    df_adv_mapping = sheets['广告主匹配'].copy()
+    df_daily_target =sheets['日均目标流水'].copy()
+    df_blacklist = sheets['预算黑名单'].copy()
+    df_traffic_type = sheets['流量类型'].copy()
+
+  
+    df_30d_flow.columns = df_30d_flow.columns.str.strip()
+    df_adv_mapping.columns = df_adv_mapping.columns.str.strip()
+    df_traffic_type.columns = df_traffic_type.columns.str.strip()
+    df_blacklist.columns = df_blacklist.columns.str.strip()
+    
+ 
+   
+    # 数据预处理：统一列名格式（去除空格/特殊字符）
+    for df in [df_30d_flow, df_adv_mapping, df_blacklist, df_traffic_type]:
+        df.columns = df.columns.str.strip().str.replace(" ", "").str.replace("—", "-")
+        
+        
+
+    # ===================== 2. 核心预处理：确保所有关键字段存在 =====================
+    # 2.1 检查并补充df_30d_flow的核心字段
+    required_flow_cols = [
+        "OfferID", "Advertiser", "AppID", "GEO", "Time", "TotalClicks", 
+        "TotalConversions", "TotalRevenue", "TotalCost", "TotalProfit", "Status"
+    ]
+    flow_col_mapping = {
+        "Offer ID": "OfferID",
+        "App ID": "AppID",
+        "Total Clicks": "TotalClicks",
+        "Total Conversions": "TotalConversions",
+        "Total Revenue": "TotalRevenue",
+        "Total Cost": "TotalCost",
+        "Total Profit": "TotalProfit"
+    }
+    df_30d_flow.rename(columns=flow_col_mapping, inplace=True)
+    for col in required_flow_cols:
+        if col not in df_30d_flow.columns:
+            df_30d_flow[col] = np.nan if col != "Time" else pd.NaT
+            logger.warning("df_30d_flow 缺失字段 %s，已创建空值列", col)
+    
+    # 2.2 检查并补充df_adv_mapping的核心字段
+    required_adv_cols = ["Advertiser", "流量匹配逻辑"]
+    adv_col_mapping = {"流量匹配规则": "流量匹配逻辑", "匹配逻辑": "流量匹配逻辑"}
+    for old_col, new_col in adv_col_mapping.items():
+        if old_col in df_adv_mapping.columns:
+            df_adv_mapping.rename(columns={old_col: new_col}, inplace=True)
+    if "流量匹配逻辑" not in df_adv_mapping.columns:
+        df_adv_mapping["流量匹配逻辑"] = ""
+        logger.warning("df_adv_mapping 缺失字段 流量匹配逻辑，已创建空值列")
+    
+    # 2.3 合并流量匹配逻辑到df_30d_flow
+    df_30d_flow = df_30d_flow.merge(
+        df_adv_mapping[["Advertiser", "流量匹配逻辑"]].drop_duplicates(),
+        on="Advertiser",
+        how="left"
+    )
+    df_30d_flow["流量匹配逻辑"] = df_30d_flow["流量匹配逻辑"].fillna("")
+    
+    # 2.4 时间字段处理
+    df_30d_flow["Time"] = pd.to_datetime(df_30d_flow["Time"], errors="coerce")
+    df_30d_flow = df_30d_flow.dropna(subset=["Time"])
+
+    
+    # ===================== 3. 提取Offer基础信息 =====================
+    # 各字段取Offer在流水中的第一行：流水汇总按首次出现顺序分组，第一组即第一行的取值；
+    # Total Caps/Payin按Offer取值，来自Offer维度表中按第一行取的字段
+    df_offer_base = df_30d_flow[
+        ["OfferID", "Advertiser", "AppID", "GEO", "AdvOfferID"]
+    ].drop_duplicates(subset=["OfferID"], keep="first")
+    offer_first_rows = offer_dimension_by_id(offer_base_info).reindex(
+        columns=["offerid", *OFFER_FIRST_ROW_COLS.values()]
+    ).rename(columns={"offerid": "OfferID", "首行Total Caps": "TotalCaps", "首行Payin": "Payin"})
+    df_offer_base = df_offer_base.merge(offer_first_rows, on="OfferID", how="left")
+
+    # TotalCaps：尝试转换为数值类型，非数字(NaN) 或 数值≤0 的按100处理
+    df_offer_base["TotalCaps"] = pd.to_numeric(df_offer_base["TotalCaps"], errors='coerce')
+    df_offer_base.loc[df_offer_base["TotalCaps"].isna() | (df_offer_base["TotalCaps"] <= 0), "TotalCaps"] = 100
+    
+    # ===================== 4. 时间范围定义 =====================
+    max_date_in_data = df_30d_flow["Time"].max()
+    last_30d_start = max_date_in_data - timedelta(days=29)
+    last_1d_start = max_date_in_data
+    
+    # 筛选数据
+    df_30d_filtered = df_30d_flow[
+        (df_30d_flow["Time"] >= last_30d_start) & 
+        (df_30d_flow["Time"] <= max_date_in_data)
+    ]
+    df_1d_filtered = df_30d_flow[df_30d_flow["Time"] == last_1d_start]
+    
+    # ===================== 5. 通用指标计算函数（补充1天全指标+1d_STATUS） =====================
+    def calculate_agg_metrics(period_frames, group_cols):
+        """
+        一次分组同时计算多个周期（30d/1d）的Offer及Affiliate汇总指标
+        参数：
+            period_frames: {周期名: 该周期的流水DataFrame}
+            group_cols: 分组字段
+        返回：
+            {周期名: (agg_total, agg_aff)}，列名带周期前缀（如 30d_TotalRevenue）
+        """
+        df_all = pd.concat(
+            [df.assign(Period=period_name) for period_name, df in period_frames.items()],
+            ignore_index=True
+        )
+        df_merged = df_all.merge(
+            df_offer_base[["OfferID", "AppID", "GEO"]],
+            on="OfferID",
+            how="left",
+            suffixes=("", "_base")
+        )
+        df_merged["AppID"] = fill_dimension(fill_dimension(df_merged["AppID"], df_merged["AppID_base"]), "未知")
+        df_merged["GEO"] = fill_dimension(fill_dimension(df_merged["GEO"], df_merged["GEO_base"]), "未知")
+        df_merged.drop(columns=["AppID_base", "GEO_base"], errors="ignore", inplace=True)
+        
+        metric_cols = ["TotalClicks", "TotalConversions", "TotalRevenue", "TotalCost", "TotalProfit"]
+        period_keys = ["Period", *group_cols]
+        
+        # 整体汇总（补充完整的1d/30d指标：Clicks/Conversions/Revenue/Cost/Profit + STATUS），sum对空值按0处理
+        agg_total = decategorize_frame(df_merged.groupby([*period_keys, "AppID", "GEO"], dropna=False, observed=True).agg(
+            **{col: (col, "sum") for col in metric_cols},
+            STATUS=("Status", "first")
+        ).reset_index())
+        agg_total["STATUS"] = agg_total["STATUS"].fillna("UNKNOWN")
+        
+        # 计算CR（转化率）
+        agg_total["CR"] = np.where(
+            agg_total["TotalClicks"] > 0,
+            agg_total["TotalConversions"] / agg_total["TotalClicks"],
+            0
+        )
+        
+        # Affiliate维度汇总（补充完整的Aff指标）
+        agg_aff = pd.DataFrame()
+        if "Affiliate" in df_merged.columns:
+            agg_aff = decategorize_frame(df_merged.groupby([*period_keys, "AppID", "GEO", "Affiliate"], dropna=False, observed=True).agg(
+                **{col.replace("Total", "Aff"): (col, "sum") for col in metric_cols}
+            ).reset_index())
+            
+            agg_aff = agg_aff.merge(
+                agg_total[[*period_keys, "TotalRevenue"]],
+                on=period_keys,
+                how="left"
+            )
+            agg_aff["AffCR"] = np.where(
+                agg_aff["AffClicks"] > 0,
+                agg_aff["AffConversions"] / agg_aff["AffClicks"],
+                0
+            )
+            agg_aff["AffRevenueRatio"] = np.where(
+                agg_aff["TotalRevenue"] > 0,
+                agg_aff["AffRevenue"] / agg_aff["TotalRevenue"],
+                0
+            )
+            
+            summary_line = (
+                "Affiliate: " + agg_aff["Affiliate"].astype(str)
+                + " | Clicks: " + agg_aff["AffClicks"].map("{:.0f}".format)
+                + " | Conversions: " + agg_aff["AffConversions"].map("{:.0f}".format)
+                + " | CR: " + agg_aff["AffCR"].map("{:.4f}".format)
+                + " | Cost: " + agg_aff["AffCost"].map("{:.2f}".format)
+                + " | Profit: " + agg_aff["AffProfit"].map("{:.2f}".format)
+                + " | Revenue占比: " + agg_aff["AffRevenueRatio"].map("{:.4f}".format)
+            )
+            aff_summary = summary_line.groupby(
+                [agg_aff[col] for col in period_keys]
+            ).agg("\n".join).reset_index(name="AffiliateSummary")
+            
+            agg_total = agg_total.merge(aff_summary, on=period_keys, how="left")
+        else:
+            agg_total["AffiliateSummary"] = "无Affiliate数据"
+        
+        # 按周期拆分并加上周期前缀
+        key_cols = [*group_cols, "AppID", "GEO", "Affiliate"]
+        
+        def split_period(df, period_name):
+            if df.empty and "Period" not in df.columns:
+                return df
+            part = df[df["Period"] == period_name].drop(columns="Period").reset_index(drop=True)
+            return part.rename(columns={col: f"{period_name}_{col}" for col in part.columns if col not in key_cols})
+        
+        return {
+            period_name: (split_period(agg_total, period_name), split_period(agg_aff, period_name))
+            for period_name in period_frames
+        }
+    
+    # ===================== 6. 计算30天/1天指标（含完整1d指标+1d_STATUS） =====================
+    group_cols = ["OfferID", "Advertiser"]
+    period_metrics = calculate_agg_metrics({"30d": df_30d_filtered, "1d": df_1d_filtered}, group_cols)
+    df_30d_metrics, df_30d_aff_metrics = period_metrics["30d"]
+    df_1d_metrics, df_1d_aff_metrics = period_metrics["1d"]
+    
+    # 计算剩余Cap
+    df_1d_metrics = df_1d_metrics.merge(
+        df_offer_base[["OfferID", "TotalCaps"]],
+        on="OfferID",
+        how="left"
+    )
+    df_1d_metrics["TotalCaps"] = pd.to_numeric(df_1d_metrics["TotalCaps"], errors="coerce").fillna(100)
+    df_1d_metrics["RemainingCap"] =  (df_1d_metrics["TotalCaps"]-df_1d_metrics["1d_TotalConversions"]).fillna(df_1d_metrics["TotalCaps"])
+    
+    # ===================== 7. 筛选合格Offer =====================
+    daily_revenue = df_30d_flow.groupby(["OfferID", "Time"], observed=True)["TotalRevenue"].sum().reset_index()
+    qualified_offers = daily_revenue[daily_revenue["TotalRevenue"].fillna(0) >= 10]["OfferID"].unique()
+    df_qualified = df_30d_metrics[df_30d_metrics["OfferID"].isin(qualified_offers)].copy()
+    
+    # ===================== 8. 补充基础信息（关联1d_STATUS替换30d_STATUS） =====================
+    flow_logic_df = df_30d_flow[["OfferID", "流量匹配逻辑"]].drop_duplicates(subset=["OfferID"])
+    df_qualified = df_qualified.merge(
+        df_offer_base[["OfferID", "AdvOfferID", "Payin", "TotalCaps"]],
+        on="OfferID",
+        how="left"
+    )
+    df_qualified = df_qualified.merge(
+        flow_logic_df,
+        on="OfferID",
+        how="left"
+    )
+    df_qualified["流量匹配逻辑"] = df_qualified["流量匹配逻辑"].fillna("")
+    df_qualified = df_qualified.merge(
+        df_1d_metrics[["OfferID", "Advertiser", "RemainingCap", "1d_STATUS"]],  # 关联1d_STATUS
+        on=["OfferID", "Advertiser"],
+        how="left"
+    )
+    df_qualified["TotalCaps"] = pd.to_numeric(df_qualified["TotalCaps"], errors="coerce").fillna(100)
+    # 填充RemainingCap空值为TotalCaps
+    df_qualified["RemainingCap"] = df_qualified["RemainingCap"].fillna(df_qualified["TotalCaps"])
+
+    # 替换30d_STATUS为1d_STATUS（核心修改）
+    df_qualified["30d_STATUS"] = df_qualified["1d_STATUS"].fillna(df_qualified["30d_STATUS"])
+    df_qualified.drop(columns=["1d_STATUS"], errors="ignore", inplace=True)
+    
+    # 补充完整的1天维度指标到df_qualified
+    df_qualified = df_qualified.merge(
+        df_1d_metrics[["OfferID", "Advertiser", "1d_TotalClicks", "1d_TotalConversions", 
+                      "1d_TotalRevenue", "1d_TotalCost", "1d_TotalProfit","1d_AffiliateSummary"]],
+        on=["OfferID", "Advertiser"],
+        how="left"
+    )
+    one_day_cols = [
+        "1d_TotalClicks", 
+        "1d_TotalConversions", 
+        "1d_TotalRevenue", 
+        "1d_TotalCost", 
+        "1d_TotalProfit"
+    ]
+    # 遍历列名，填充空值为0，并转换为数值类型
+    for col in one_day_cols:
+        # 先转换为数值类型（处理可能的非数值数据），再填充空值
+        df_qualified[col] = pd.to_numeric(df_qualified[col], errors="coerce").fillna(0)
+    
+    # ===================== 9. 流量匹配与黑名单过滤 =====================
+    def match_traffic_affiliate(traffic_logic):
+        """按流量匹配逻辑匹配可用Affiliate（已排除"不沟通"的Affiliate）"""
+        if not traffic_logic:
+            return []
+        
+        keywords = traffic_logic.split("/")
+        traffic_type_col = "流量类型--一级分类" if "流量类型--一级分类" in df_traffic_type.columns else "流量类型"
+        if traffic_type_col not in df_traffic_type.columns:
+            return []
+        
+        mask = df_traffic_type[traffic_type_col].str.contains("|".join(keywords), na=False)
+        df_matched = df_traffic_type[mask]
+        
+        if "inapp流量" in traffic_logic or "inapp 流量" in traffic_logic:
+            priority_col = "非100%xdj新预算推量优先级"
+        else:
+            priority_col = "纯xdj新预算推量优先级"
+        
+        if priority_col in df_matched.columns:
+            df_matched = df_matched[df_matched[priority_col] != "不沟通"]
+        
+        return df_matched["Affiliate"].tolist()
+    
+    # 流量匹配逻辑只有少数几种取值：每种逻辑只匹配一次，生成 逻辑 → Affiliate 候选表，再按逻辑关联展开
+    traffic_candidates = pd.DataFrame(
+        [(logic, aff) for logic in df_qualified["流量匹配逻辑"].unique() for aff in match_traffic_affiliate(logic)],
+        columns=["流量匹配逻辑", "Affiliate"]
+    )
+    df_qualified = df_qualified.merge(traffic_candidates, on="流量匹配逻辑", how="left")
+    df_qualified["Affiliate"] = df_qualified["Affiliate"].fillna("未知")
+    
+    # 过滤黑名单
+    blacklist_all = df_blacklist[(df_blacklist["Affiliate"] == "All")]["OfferID"].unique() if "Affiliate" in df_blacklist.columns else []
+    df_qualified = df_qualified[~df_qualified["OfferID"].isin(blacklist_all)]
+    
+    if "Affiliate" in df_blacklist.columns and "OfferID" in df_blacklist.columns:
+        blacklist_specific = df_blacklist[df_blacklist["Affiliate"] != "All"][["OfferID", "Affiliate"]]
+        df_qualified = df_qualified.merge(
+            blacklist_specific,
+            on=["OfferID", "Affiliate"],
+            how="left",
+            indicator=True
+        )
+        df_qualified = df_qualified[df_qualified["_merge"] == "left_only"].drop(columns=["_merge"])
+    
+    # 筛选条件改为使用1d_STATUS（原30d_STATUS已替换）
+    df_qualified = df_qualified[df_qualified["30d_STATUS"] == "ACTIVE"]
+    
+    # ===================== 10. 待办事项标记（规则a/c/d） =====================
+    df_qualified["待办事项标记"] = ""
+    
+    
+    # 补充Affiliate收入字段
+    if not df_1d_aff_metrics.empty:
+        merge_cols = [col for col in [*group_cols, "Affiliate", "1d_AffRevenue"] if col in df_1d_aff_metrics.columns]
+        df_qualified = df_qualified.merge(
+            df_1d_aff_metrics[merge_cols],
+            on=[col for col in merge_cols if col != "1d_AffRevenue"],
+            how="left"
+        )
+    else:
+        df_qualified["1d_AffRevenue"] = 0
+    
+    if not df_30d_aff_metrics.empty:
+        merge_cols = [col for col in [*group_cols, "Affiliate", "30d_AffRevenue"] if col in df_30d_aff_metrics.columns]
+        df_qualified = df_qualified.merge(
+            df_30d_aff_metrics[merge_cols],
+            on=[col for col in merge_cols if col != "30d_AffRevenue"],
+            how="left"
+        )
+    else:
+        df_qualified["30d_AffRevenue"] = 0
+    
+    # 规则a：剩余Cap<0 → 沟通加预算
+    mask_a = df_qualified["RemainingCap"].fillna(0) < 0
+    df_qualified.loc[mask_a, "待办事项标记"] = "和广告主沟通是否可以加预算"
+
+    # 沟通加预算记录的Affiliate置空 + 去重
+    df_qualified.loc[df_qualified["待办事项标记"] == "和广告主沟通是否可以加预算", "Affiliate"] = ""
+    dedup_cols = ["OfferID", "Advertiser", "AppID", "GEO", "Affiliate", "待办事项标记"]
+    df_qualified = df_qualified.drop_duplicates(subset=dedup_cols, keep="first")
+    
+    # 规则c：昨日有收入 → 推满预算（使用1d_TotalRevenue判断）
+    mask_c = (df_qualified["待办事项标记"] == "") & (df_qualified["1d_AffRevenue"].fillna(0) > 0)
+    df_qualified.loc[mask_c, "待办事项标记"] = "该流量昨日有产生流水，推流量把预算跑满"
+    
+    # 规则d：近30天有收入但昨日无 → 持续跑预算
+    mask_d = (df_qualified["待办事项标记"] == "") & (df_qualified["30d_AffRevenue"].fillna(0) > 0) & (df_qualified["1d_AffRevenue"].fillna(0) == 0)
+    df_qualified.loc[mask_d, "待办事项标记"] = "该流量近30天内有产生流水，但昨日无产生流水，推流量持续跑预算"
+    
+    # ===================== 11. 核心逻辑i：规则e（匹配昨日有流水的其他Offer） =====================
+    # 推量优先级文本索引：{优先级字段: {Affiliate: 文本}}，同一Affiliate取流量类型表中第一行
+    priority_cols = ["非100%xdj新预算推量优先级", "纯xdj新预算推量优先级"]
+    priority_text_index = {}
+    traffic_first = df_traffic_type.drop_duplicates(subset=["Affiliate"], keep="first")
+    for col in priority_cols:
+        if col in df_traffic_type.columns:
+            priority_text_index[col] = {
+                aff: (text if text else "无明确推量优先级指引")
+                for aff, text in zip(traffic_first["Affiliate"], traffic_first[col])
+                if pd.notna(aff)
+            }
+    
+    # 昨日有流水的其他Offer候选索引：(Affiliate, AppID, GEO) → 昨日流水最高的Offer，
+    # 以及排除该Offer后流水最高的Offer（当前Offer本身就是最高时使用）
+    df_1d_full = df_1d_metrics[["OfferID", "Advertiser", "AppID", "GEO", 
+                               "1d_TotalRevenue", "1d_TotalClicks", "1d_TotalConversions",
+                               "1d_TotalCost", "1d_TotalProfit"]].copy()
+    if not df_1d_aff_metrics.empty:
+        df_1d_full = df_1d_full.merge(
+            df_1d_aff_metrics[["OfferID", "Advertiser", "Affiliate"]].drop_duplicates(),
+            on=["OfferID", "Advertiser"],
+            how="left"
+        )
+    else:
+        df_1d_full["Affiliate"] = np.nan
+    match_keys = ["Affiliate", "AppID", "GEO"]
+    df_1d_full = df_1d_full[
+        df_1d_full[match_keys].notna().all(axis=1) & (df_1d_full["1d_TotalRevenue"].fillna(0) > 0)
+    ].sort_values("1d_TotalRevenue", ascending=False, kind="stable")
+    df_1d_full["OfferDesc"] = (
+        "具体预算信息为Offer ID：" + df_1d_full["OfferID"].astype(str)
+        + "、App ID：" + df_1d_full["AppID"].astype(str)
+        + "、GEO：" + df_1d_full["GEO"].astype(str)
+        + "、Advertiser：" + df_1d_full["Advertiser"].astype(str) + "，"
+        + "对应昨日流水是" + df_1d_full["1d_TotalRevenue"].map("{:.2f}".format)
+        + "美金（昨日点击：" + df_1d_full["1d_TotalClicks"].map("{:.0f}".format)
+        + "，转化：" + df_1d_full["1d_TotalConversions"].map("{:.0f}".format)
+        + "，成本：" + df_1d_full["1d_TotalCost"].map("{:.2f}".format)
+        + "，利润：" + df_1d_full["1d_TotalProfit"].map("{:.2f}".format) + "），"
+    )
+    top_offer = df_1d_full.groupby(match_keys, sort=False).head(1)[[*match_keys, "OfferID", "OfferDesc"]]
+    runner_up = df_1d_full.merge(top_offer[[*match_keys, "OfferID"]], on=match_keys, suffixes=("", "_top"))
+    runner_up = runner_up[runner_up["OfferID"] != runner_up["OfferID_top"]]
+    runner_up = runner_up.groupby(match_keys, sort=False).head(1)[[*match_keys, "OfferDesc"]]
+    other_offer_index = top_offer.merge(
+        runner_up, on=match_keys, how="left", suffixes=("", "_runner_up")
+    ).rename(columns={"OfferID": "TopOfferID"})
+    
+    def match_other_offer(df_rows):
+        """按候选索引批量生成规则e文案（一次join，不再逐行扫描昨日流水）"""
+        traffic_logic = df_rows["流量匹配逻辑"].fillna("")
+        is_inapp = traffic_logic.str.contains("Inapp流量", regex=False) | traffic_logic.str.contains("inapp流量", regex=False)
+        priority_col = pd.Series(np.where(is_inapp, priority_cols[0], priority_cols[1]), index=df_rows.index)
+        
+        # 获取优先级文本
+        affiliate = df_rows["Affiliate"]
+        known_aff = affiliate.notna() & ~affiliate.isin(["未知", ""])
+        priority_text = pd.Series("无明确推量优先级指引", index=df_rows.index, dtype=object)
+        for col, text_by_aff in priority_text_index.items():
+            use_col = (priority_col == col) & known_aff
+            priority_text[use_col] = [text_by_aff.get(aff, "无明确推量优先级指引") for aff in affiliate[use_col]]
+        priority_text = priority_text.astype(str)
+        guide_txt = "按照" + priority_col + "指引进行操作：" + priority_text
+        
+        # 基础校验通过的行才匹配其他Offer
+        valid = df_rows["AppID"].notna() & df_rows["GEO"].notna() & known_aff
+        matched = df_rows[match_keys + ["OfferID"]].merge(other_offer_index, on=match_keys, how="left")
+        matched.index = df_rows.index
+        other_desc = matched["OfferDesc"].where(matched["TopOfferID"] != matched["OfferID"], matched["OfferDesc_runner_up"])
+        other_desc = other_desc.where(valid)
+        
+        # 返回文案
+        push_txt = "该流量已经在其他offerid相同预算下(状态为暂停或者预算不足)产生流水，" + other_desc.fillna("") + "和流量沟通push新预算，新增预算预算" + guide_txt
+        return push_txt.where(other_desc.notna(), guide_txt)
+    
+    # 规则e筛选
+    mask_e = df_qualified["待办事项标记"] == ""
+    mask_budgeted = ~mask_e
+    df_budgeted = df_qualified[mask_budgeted][["Affiliate", "GEO", "AppID"]].drop_duplicates()
+    df_qualified["match_key"] = df_qualified["Affiliate"].fillna("") + "|" + df_qualified["GEO"].fillna("") + "|" + df_qualified["AppID"].fillna("")
+    df_budgeted["match_key"] = df_budgeted["Affiliate"].fillna("") + "|" + df_budgeted["GEO"].fillna("") + "|" + df_budgeted["AppID"].fillna("")
+    mask_e_filtered = mask_e & (~df_qualified["match_key"].isin(df_budgeted["match_key"].tolist()))
+    df_e = df_qualified[mask_e_filtered].copy()
+    df_qualified.drop(columns=["match_key"], inplace=True)
+    
+    # 应用核心逻辑i
+    df_e["待办事项标记"] = match_other_offer(df_e)
+    df_qualified.loc[mask_e_filtered, "待办事项标记"] = df_e["待办事项标记"]
+    
+    mask_keep = mask_budgeted | mask_e_filtered
+    df_qualified = df_qualified[mask_keep].copy()
+
+    # 2. 删除临时匹配键列
+    df_qualified.drop(columns=["match_key"], inplace=True, errors="ignore")
+    
+    # ===================== 12. 核心逻辑ii：仅针对规则e——按Affiliate+AppID+GEO保留组内最高流水Offer =====================
+    # 步骤1：拆分规则a/c/d和规则e（规则a/c/d完整保留）
+    mask_acd = df_qualified["待办事项标记"].isin([
+        "和广告主沟通是否可以加预算",
+        "该流量昨日有产生流水，推流量把预算跑满",
+        "该流量近30天内有产生流水，但昨日无产生流水，推流量持续跑预算"
+    ])
+    df_acd = df_qualified[mask_acd].copy()
+    
+    # 提取规则e数据（去除a/c/d后的所有行）
+    df_e = df_qualified[~mask_acd].copy()
+    
+    # 步骤2：仅对规则e执行核心逻辑（你的需求）
+    if not df_e.empty:
+        # 1. 处理空值，避免分组错误（不影响核心逻辑）
+        df_e["Affiliate"] = df_e["Affiliate"].fillna("未知")
+        df_e["AppID"] = df_e["AppID"].fillna("未知")
+        df_e["GEO"] = df_e["GEO"].fillna("未知")
+        df_e["30d_TotalRevenue"] = pd.to_numeric(df_e["30d_TotalRevenue"], errors="coerce").fillna(0)
+        
+        # 2. 关键：按Affiliate+AppID+GEO分组，对每个组内的OfferID按流水降序排序
+        #    排序后，每组第一行就是流水最高的OfferID
+        df_e_sorted = df_e.sort_values(
+            by=["Affiliate", "AppID", "GEO", "30d_TotalRevenue"],
+            ascending=[True, True, True, False]  # 流水降序，保证最高的在最前
+        )
+        
+        # 3. 去重：每个Affiliate+AppID+GEO只保留第一行（流水最高的OfferID）
+        df_e_final = df_e_sorted.drop_duplicates(
+            subset=["Affiliate", "AppID", "GEO"],
+            keep="first"
+        ).reset_index(drop=True)
+    else:
+        df_e_final = pd.DataFrame()
+    
+    # 步骤3：合并最终数据（规则a/c/d + 规则e去重后）
+    df_final = pd.concat([df_acd, df_e_final], ignore_index=True)
+                         
+    
+    # ===================== 13. 待办事项排序 =====================
+    last_1d_weekday = max_date_in_data.weekday()
+    df_final["待办事项排序"] = ""
+    
+    #步骤1：提取Advertiser+OfferID的唯一组合，保留30d_TotalRevenue
+    df_rank_base = df_final[["Advertiser", "OfferID", "30d_TotalRevenue"]].drop_duplicates(
+    subset=["Advertiser", "OfferID"],  # 确保每个OfferID在每个Advertiser下只算一次
+    keep="first"  # 保留第一条记录（同一OfferID的30d_TotalRevenue值一致）
+      )
+
+    #步骤2：按Advertiser分组，对30d_TotalRevenue降序计算唯一排序
+    df_rank_base["排序"] = df_rank_base.groupby("Advertiser")["30d_TotalRevenue"].rank(
+    ascending=False,
+    method="first"  # 相同营收时按出现顺序排名，避免并列
+    ).astype(int)
+
+    #步骤3：将唯一排序值关联回原数据（同一个OfferID会获得相同排序）
+    df_final = df_final.merge(
+    df_rank_base[["Advertiser", "OfferID", "排序"]],
+    on=["Advertiser", "OfferID"],
+    how="left"
+     ) 
+    
+     
+    def is_similar_name(row):
+      # 去除两端空白，统一转为小写（避免大小写干扰）
+      adv = str(row["Advertiser"]).strip().lower()
+      aff = str(row["Affiliate"]).strip().lower()
+    
+      # 排除空值情况
+      if not adv or not aff:
+        return False
+       # 判断核心包含关系：一个字符串是另一个的子串（且不是完全空白）
+      if (adv in aff) or (aff in adv):
+        return True
+      special_pair = {"leapmob", "metabits"}
+      
+      if {adv, aff} == special_pair:
+          return True
+          
+      return False
+  
+    mask_similar = df_final.apply(
+    is_similar_name, axis=1)
+    
+    df_final = df_final[~mask_similar].reset_index(drop=True)
+    
+    
+    target_date = datetime.now().date()
+    
+    start_of_week = target_date - timedelta(days=target_date.weekday())
+    
+    days_in_week_so_far = [
+        start_of_week + timedelta(days=i) 
+        for i in range((target_date - start_of_week).days + 1)
+    ]
+    workdays = [d for d in days_in_week_so_far if is_workday(d)]
+    workdays_count = len(workdays)
+    
+    
+    
+    
+    # 规则1：昨日有流水 + 第一个工作日+排序前10 → 第一优先级
+    mask_p1 = (df_final["待办事项标记"] == "该流量昨日有产生流水，推流量把预算跑满")&(df_final["排序"] <= 10)
+    
+    mask_p2 = (df_final["待办事项标记"] == "和广告主沟通是否可以加预算") 
+    
+    mask_p3 = (df_final["待办事项标记"] == "该流量近30天内有产生流水，但昨日无产生流水，推流量持续跑预算") & (df_final["排序"] <= 10) 
+    
+    mask_p4 = (df_final["待办事项标记"].str.contains(r"流量已经在其他offerid相同预算下.*状态为暂停或者预算不足.*产生流水")) & (df_final["排序"] <= 10) 
+
+    mask_all_rules = mask_p1 | mask_p2 | mask_p3|mask_p4
+    
+    mask_p5 = (df_final["排序"] <= 3) & (~mask_all_rules)
+    
+    
+    if workdays_count==1:
+        df_final.loc[mask_p1, "待办事项排序"] = "今日第一优先级待办"
+    elif workdays_count==2:
+        df_final.loc[mask_p2, "待办事项排序"] = "今日第一优先级待办"
+        df_final.loc[mask_p3, "待办事项排序"] = "今日第二优先级待办"
+    elif workdays_count==3:
+        df_final.loc[mask_p4, "待办事项排序"] = "今日第一优先级待办"
+        df_final.loc[mask_p5, "待办事项排序"] = "今日第二优先级待办"
+
+    
+
+    
+  
+    # 定义输出列（包含完整的1天维度指标）
+    output_cols = [
+        "OfferID", "Advertiser", "AdvOfferID", "AppID", "GEO", "Affiliate", "Payin", "TotalCaps",
+        # 30天指标
+        "30d_TotalClicks", "30d_TotalConversions", "30d_CR", "30d_TotalRevenue", 
+        "30d_TotalCost", "30d_TotalProfit", "30d_STATUS", "30d_AffiliateSummary",
+        # 1天指标（完整）
+        "1d_TotalClicks", "1d_TotalConversions", "1d_TotalRevenue", 
+        "1d_TotalCost", "1d_TotalProfit", "1d_AffiliateSummary",'1d_AffRevenue', '30d_AffRevenue'
+        # 其他字段
+        "RemainingCap", "排序", "待办事项标记", "待办事项排序"
+    ]
+    output_cols = [col for col in output_cols if col in df_final.columns]
+    
+    # 最终结果去重
+    final_output = df_final[output_cols].drop_duplicates().reset_index(drop=True)
+    
+    # 还原字段名为带空格的格式
+    reverse_col_mapping = {
+        "OfferID": "Offer ID",
+        "AppID": "App ID",
+        "AdvOfferID": "Adv Offer ID",
+        "TotalCaps": "Total Caps",
+        "RemainingCap": "Remaining_Cap",
+        "30d_TotalClicks": "30d_Total Clicks",
+        "30d_TotalConversions": "30d_Total Conversions",
+        "30d_TotalRevenue": "30d_Total Revenue",
+        "30d_TotalCost": "30d_Total Cost",
+        "30d_TotalProfit": "30d_Total Profit",
+        "30d_AffiliateSummary": "30d_Affiliate_Summary",
+        "1d_TotalClicks": "1d_Total Clicks",
+        "1d_TotalConversions": "1d_Total Conversions",
+        "1d_TotalRevenue": "1d_Total Revenue",
+        "1d_TotalCost": "1d_Total Cost",
+        "1d_TotalProfit": "1d_Total Profit",
+        "1d_AffiliateSummary":'1d_Affiliate_Summary'
+    }
+    final_output.rename(columns=reverse_col_mapping, inplace=True)
+    
+    return final_output
+
+
+class SheetAccessRecorder(dict):
+    """sheets的浅拷贝，记录规则实际读取了哪些sheet（用于统计各规则的输入行数）"""
+
+    def __init__(self, sheets):
+        super().__init__(sheets)
+        self.accessed = set()
+
+    def __getitem__(self, key):
+        self.accessed.add(key)
+        return super().__getitem__(key)
+
+
+def run_analysis(sheets, offer_base_info, max_workers=ANALYSIS_MAX_WORKERS, trace=None):
+    """执行全部分析规则，返回 {报告sheet名称: DataFrame}（顺序即报告中的sheet顺序）
+    各规则只读sheets/offer_base_info，互不依赖的规则并行执行；
+    依赖关系：reject事件 → 最新两天汇总表 → 总数据、Advertiser/Affiliate数据；reject事件 → event事件分析、GEO/App ID等维度对比
+    传入trace时记录每个规则的耗时、内存峰值，以及读取的sheet和其他DataFrame参数的总行数/结果行数
+    """
+    def timed(func):
+        def run(sheets, *args):
+            recorder = SheetAccessRecorder(sheets)
+            with trace_stage(trace, func.__name__) as record:
+                result = func(recorder, *args)
+                inputs = [sheets[key] for key in recorder.accessed] + list(args)
+                record["rows_in"] = frame_rows(inputs)
+                record["rows_out"] = frame_rows(result)
+            return result
+        return run
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # 第一批：不依赖其他规则结果的规则
+        date_new, date_old = latest_two_days(sheets["流水汇总"])
+        reject_future = pool.submit(timed(calculate_reject_data), sheets)
+        fluctuation_future = pool.submit(timed(calculate_budget_fluctuation), sheets, offer_base_info)
+        large_drop_future = pool.submit(timed(calculate_large_drop_budget), sheets, offer_base_info)
+        rules_future = pool.submit(timed(calculate_budget_rules), sheets, offer_base_info)
+        
+        influence_future = pool.submit(timed(calculate_profit_influence), sheets, date_new, date_old)
+        
+        # 第二批：依赖reject事件的规则，以及从最新两天汇总表取数的规则
+        reject_event_df = reject_future.result()
+        event_future = pool.submit(timed(calculate_event_analysis), sheets, offer_base_info, reject_event_df)
+        rollup = pool.submit(timed(build_two_day_rollup), sheets, date_new, date_old, reject_event_df).result()
+        total_future = pool.submit(timed(calculate_total_data), sheets, date_new, date_old, rollup)
+        advertiser_future = pool.submit(timed(calculate_advertiser_data), sheets, date_new, date_old, rollup)
+        affiliate_future = pool.submit(timed(calculate_affiliate_data), sheets, date_new, date_old, rollup)
+        dimension_futures = {
+            sheet_name: pool.submit(timed(calculate_dimension_data), sheets, date_new, date_old, reject_event_df, dims)
+            for sheet_name, dims in DIMENSION_COMPARE_SHEETS.items()
+        }
+        
+        total_data = total_future.result()
+        budget_fluctuation = fluctuation_future.result()
+        advertiser_data = advertiser_future.result()
+        affiliate_data = affiliate_future.result()
+        large_drop_budget = large_drop_future.result()
+        profit_influence = influence_future.result()
+        final_output = rules_future.result()
+        reject_analysis, non_reject_analysis = event_future.result()
+
+    return {
+        "1-总数据": total_data,
+        "2-预算波动": budget_fluctuation,
+        "3-Advertiser数据": advertiser_data,
+        "4-Affiliate数据": affiliate_data,
+        "5-流水大幅下降预算": large_drop_budget,
+        "6-利润影响分析": pd.DataFrame({"利润影响因素分析": [profit_influence]}),
+        "7-reject事件分析": reject_analysis,
+        "8-非reject事件分析": non_reject_analysis,
+        "9-今日待办事项": final_output,
+        **{sheet_name: future.result() for sheet_name, future in dimension_futures.items()},
+    }
+
+
+def write_report_pandas(results, path, trace=None):
+    """pandas ExcelWriter（openpyxl）写出报告：整个workbook对象模型保存在内存中，最后一次性写盘"""
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for sheet_name, df in results.items():
+            with trace_stage(trace, f"写入 {sheet_name}", len(df)):
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+
+
+def write_report_streaming(results, path, trace=None):
+    """openpyxl只写模式写出报告：逐行追加，每个sheet边写边落到临时文件，不保留workbook对象模型
+    表头样式与pandas to_excel一致（加粗、细边框、居中）；空值写为空单元格
+    """
+    thin = Side(style="thin")
+    header_font = Font(bold=True)
+    header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_alignment = Alignment(horizontal="center", vertical="top")
+
+    workbook = Workbook(write_only=True)
+    for sheet_name, df in results.items():
+        with trace_stage(trace, f"写入 {sheet_name}", len(df)):
+            sheet = workbook.create_sheet(sheet_name)
+            header = []
+            for col in df.columns:
+                cell = WriteOnlyCell(sheet, value=str(col))
+                cell.font = header_font
+                cell.border = header_border
+                cell.alignment = header_alignment
+                header.append(cell)
+            sheet.append(header)
+            # 转为object后numpy数值变为Python数值，空值统一为None
+            values = df.astype(object).where(df.notna(), None)
+            for row in values.itertuples(index=False, name=None):
+                sheet.append(row)
+    with trace_stage(trace, "保存xlsx"):
+        workbook.save(path)
+
+
+REPORT_WRITERS = {
+    "streaming": write_report_streaming,
+    "openpyxl": write_report_pandas,
+}
+
+
+def write_report_xlsx(results, path, trace=None, writer=REPORT_WRITER):
+    """将所有结果写入一个Excel文件（每个结果一个sheet），传入trace时记录每个sheet的写入耗时"""
+    REPORT_WRITERS[writer](results, path, trace)
+
+
+def build_report_bundle(sheets, offer_base_info, xlsx_path, trace=None):
+    """执行完整分析流程并把报告写到xlsx_path，返回报告结果包：各sheet的DataFrame + 报告文件路径 + 运行记录
+    传入trace时在其后追加各规则及各sheet写入的运行记录（不传时新建）
+    """
+    trace = [] if trace is None else trace
+    results = run_analysis(sheets, offer_base_info, trace=trace)
+    write_report_xlsx(results, xlsx_path, trace)
+    return {"results": results, "xlsx_path": xlsx_path, "trace": trace}
@@ -0,0 +1,184 @@
+import argparse
+import math
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from adv_report_core import TEMPLATE_SHEETS, write_report_xlsx
+
+# 按Excel模板的7个sheet格式生成模拟数据（性能测试/容量评估用），各sheet之间的广告主、Affiliate、Event相互对应
+# 用法：python adv_report_synth.py 输出文件.xlsx [--flow-rows 100000] [--seed 0]
+
+
+# -------------------------- 配置项 --------------------------
+# 平均每个Offer投放的Affiliate数，以及某天某个Affiliate没有流水（不出现在流水中）的概率
+AFFILIATES_PER_OFFER = 5
+FLOW_GAP_RATE = 0.15
+# 各字段的取值范围（与实际模板数据的取值形式一致：Total Caps混合数字和文本，部分字段有空值）
+GEOS = ["US", "IN", "BR", "ID", "MX", "TH", "VN", "PH"]
+TOTAL_CAPS = [50, 100, 0, "open", np.nan, 300]
+TRAFFIC_LOGICS = ["inapp流量/xdj", "xdj", "", "DSP/xdj"]
+TRAFFIC_TYPES = ["inapp流量", "xdj", "DSP", "xdj流量"]
+NON_XDJ_PRIORITIES = ["高", "不沟通", "中"]
+XDJ_PRIORITIES = ["低", "中", "不沟通", ""]
+EVENTS = {"install": False, "reject_fraud": True, "reject_dup": True, "purchase": False, "register": False}
+# Excel单个sheet的最大行数（含表头）
+EXCEL_MAX_ROWS = 1048576
+
+
+def offers_for_flow_rows(flow_rows, n_days=30, affiliates_per_offer=AFFILIATES_PER_OFFER):
+    """估算生成约flow_rows行流水所需的Offer数（Offer平均在线约一半天数）"""
+    rows_per_offer = (n_days + 1) / 2 * affiliates_per_offer * (1 - FLOW_GAP_RATE)
+    return max(1, math.ceil(flow_rows / rows_per_offer))
+
+
+def generate_sheets(n_offers=1000, n_affiliates=100, n_advertisers=40, n_days=30,
+                    events_per_row=0.9, end_date=None, seed=0):
+    """生成模板格式的全部sheet，返回 {内部sheet名称: DataFrame}（名称与TEMPLATE_SHEETS一致）
+    参数：
+        n_offers/n_affiliates/n_advertisers: Offer、Affiliate、广告主数量
+        n_days: 流水覆盖的天数（截止到end_date，默认昨天）
+        events_per_row: 有转化的每行流水平均产生的event条数
+    """
+    rng = np.random.default_rng(seed)
+    end_date = end_date or (datetime.now() - timedelta(days=1)).date()
+
+    # 广告主匹配：第一个广告主归属Appnext（部分规则对Appnext做单独处理）
+    advertisers = [f"Adv{i}" for i in range(n_advertisers)]
+    level3 = ["Appnext" if i == 0 else f"L3_{i % 4}" for i in range(n_advertisers)]
+    adv_match = pd.DataFrame({
+        "Advertiser": advertisers,
+        "二级广告主": [f"L2_{i % 6}" for i in range(n_advertisers)],
+        "三级广告主": level3,
+        "流量匹配逻辑": [TRAFFIC_LOGICS[i % len(TRAFFIC_LOGICS)] for i in range(n_advertisers)],
+    })
+    level3_names = sorted(set(level3))
+    daily_target = pd.DataFrame({
+        "三级广告主": level3_names,
+        "本月日均目标流水(美金)": rng.integers(5, 50, len(level3_names)) * 100,
+    })
+
+    affiliates = np.array([f"aff{i}" for i in range(n_affiliates)], dtype=object)
+    traffic_type = pd.DataFrame({
+        "Affiliate": affiliates,
+        "流量类型--一级分类": [TRAFFIC_TYPES[i % len(TRAFFIC_TYPES)] for i in range(n_affiliates)],
+        "非100%xdj新预算推量优先级": [NON_XDJ_PRIORITIES[i % len(NON_XDJ_PRIORITIES)] for i in range(n_affiliates)],
+        "纯xdj新预算推量优先级": [XDJ_PRIORITIES[i % len(XDJ_PRIORITIES)] for i in range(n_affiliates)],
+    })
+    reject_rules = pd.DataFrame({"Event": list(EVENTS), "是否为reject": list(EVENTS.values())})
+
+    # Offer维度：每个Offer从第start_offset天开始在线，固定投放若干Affiliate
+    offer_ids = np.arange(10000, 10000 + n_offers)
+    offer_adv = np.array(advertisers, dtype=object)[np.arange(n_offers) % n_advertisers]
+    offer_caps = pd.Series(TOTAL_CAPS, dtype=object).iloc[rng.integers(0, len(TOTAL_CAPS), n_offers)].to_numpy()
+    offer_status = np.where(rng.random(n_offers) < 0.8, "ACTIVE", "PAUSE").astype(object)
+    offer_app = np.array([f"com.app{i % max(1, n_offers // 5)}" for i in range(n_offers)], dtype=object)
+    offer_geo = np.array(GEOS, dtype=object)[np.arange(n_offers) % len(GEOS)]
+    offer_payin = rng.uniform(0.1, 3, n_offers).round(2)
+    start_offset = rng.integers(0, n_days, n_offers)
+
+    # 展开 Offer × Affiliate × 在线天数
+    n_affs = np.minimum(rng.integers(1, 2 * AFFILIATES_PER_OFFER, n_offers), n_affiliates)
+    pair_offer = np.repeat(np.arange(n_offers), n_affs)
+    pair_aff = np.concatenate([rng.choice(n_affiliates, k, replace=False) for k in n_affs])
+    pair_days = n_days - start_offset[pair_offer]
+    row_pair = np.repeat(np.arange(len(pair_offer)), pair_days)
+    # 每个pair内的第几天（从该Offer的第一天起）
+    row_day = np.arange(len(row_pair)) - np.repeat(np.cumsum(pair_days) - pair_days, pair_days)
+    keep = rng.random(len(row_pair)) >= FLOW_GAP_RATE
+    row_pair, row_day = row_pair[keep], row_day[keep]
+    row_offer = pair_offer[row_pair]
+    n_rows = len(row_pair)
+
+    first_day = pd.Timestamp(end_date - timedelta(days=n_days - 1))
+    row_time = first_day + pd.to_timedelta(start_offset[row_offer] + row_day, unit="D")
+    clicks = rng.integers(0, 5000, n_rows)
+    conversions = rng.binomial(clicks, 0.01)
+    revenue = (conversions * offer_payin[row_offer] * rng.uniform(0.5, 1.5, n_rows)).round(2)
+    cost = (revenue * rng.uniform(0.5, 1.0, n_rows)).round(2)
+    affiliate = affiliates[pair_aff[row_pair]]
+    affiliate[rng.random(n_rows) < 0.01] = np.nan
+    online_hour = rng.integers(0, 25, n_rows).astype(float)
+    online_hour[rng.random(n_rows) < 0.05] = np.nan
+
+    flow = pd.DataFrame({
+        "Time": row_time,
+        "Offer ID": offer_ids[row_offer],
+        "Adv Offer ID": pd.Series(offer_ids[row_offer]).map("adv-{}".format).to_numpy(),
+        "Advertiser": offer_adv[row_offer],
+        "App ID": offer_app[row_offer],
+        "GEO": offer_geo[row_offer],
+        "Total Caps": offer_caps[row_offer],
+        "Status": offer_status[row_offer],
+        "Payin": offer_payin[row_offer],
+        "Affiliate": affiliate,
+        "Total Clicks": clicks,
+        "Total Conversions": conversions,
+        "Total Revenue": revenue,
+        "Total Cost": cost,
+        "Total Profit": (revenue - cost).round(2),
+        "Online hour": online_hour,
+    }).sort_values(["Time", "Offer ID"], kind="stable", ignore_index=True)
+
+    # event：有转化的流水行随机产生若干条event，Offer Name中带 [Offer ID]
+    converted = flow[flow["Total Conversions"] > 0]
+    n_events = rng.poisson(events_per_row, len(converted))
+    source = converted.loc[converted.index.repeat(n_events)]
+    event_names = np.array(list(EVENTS) + [None], dtype=object)
+    events = pd.DataFrame({
+        "Time": source["Time"].to_numpy() + pd.to_timedelta(rng.integers(0, 23, len(source)), unit="h"),
+        "Offer Name": source["Offer ID"].map("offer name [{}]".format).to_numpy(),
+        "Advertiser": source["Advertiser"].to_numpy(),
+        "Affiliate": source["Affiliate"].to_numpy(),
+        "Event": event_names[rng.integers(0, len(event_names), len(source))],
+    })
+
+    # 预算黑名单：少量Offer对全部Affiliate（All）或指定Affiliate拉黑
+    blacklist_offers = offer_ids[rng.choice(n_offers, min(n_offers, 20), replace=False)]
+    blacklist = pd.DataFrame({
+        "Offer ID": blacklist_offers,
+        "Affiliate": ["All" if i % 3 == 0 else affiliates[i % n_affiliates] for i in range(len(blacklist_offers))],
+    })
+
+    return {
+        "流水数据": flow,
+        "reject规则": reject_rules,
+        "广告主匹配": adv_match,
+        "event事件": events,
+        "日均目标流水": daily_target,
+        "预算黑名单": blacklist,
+        "流量类型": traffic_type,
+    }
+
+
+def write_workbook(sheets, path):
+    """按模板的sheet名称写出xlsx（流式写出，百万行级别也不会占用大量内存）"""
+    for key, df in sheets.items():
+        if len(df) >= EXCEL_MAX_ROWS:
+            raise ValueError(f"{TEMPLATE_SHEETS[key]} 共{len(df)}行，超过Excel单个sheet的行数上限")
+    write_report_xlsx({TEMPLATE_SHEETS[key]: df for key, df in sheets.items()}, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按Excel模板格式生成模拟数据文件")
+    parser.add_argument("output", help="输出的xlsx路径")
+    parser.add_argument("--flow-rows", type=int, default=None, help="目标流水行数（按此估算Offer数，优先于--offers）")
+    parser.add_argument("--offers", type=int, default=1000, help="Offer数量")
+    parser.add_argument("--affiliates", type=int, default=100, help="Affiliate数量")
+    parser.add_argument("--advertisers", type=int, default=40, help="广告主数量")
+    parser.add_argument("--days", type=int, default=30, help="流水覆盖天数")
+    parser.add_argument("--events-per-row", type=float, default=0.9, help="有转化的每行流水平均产生的event条数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args(argv)
+
+    n_offers = offers_for_flow_rows(args.flow_rows, args.days) if args.flow_rows else args.offers
+    sheets = generate_sheets(n_offers, args.affiliates, args.advertisers, args.days, args.events_per_row, seed=args.seed)
+    write_workbook(sheets, args.output)
+    print(f"已生成 {args.output}：流水 {len(sheets['流水数据'])} 行，event {len(sheets['event事件'])} 行", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
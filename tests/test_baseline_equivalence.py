@@ -0,0 +1,123 @@
+# 在模拟workbook上，当前实现的每个报告sheet与原始规则的结果逐个比较
+# 原始规则直接从git历史中的基线版本读取（拆分为adv_report_core之前的adv_report_github.py）
+# 模拟数据的维度字段带少量空值并打乱流水行顺序，覆盖按Offer取值、首次出现顺序等依赖原始行的逻辑
+import os
+import subprocess
+import sys
+import types
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import adv_report_core  # noqa: E402
+from adv_report_synth import generate_sheets, write_workbook  # noqa: E402
+
+
+# -------------------------- 配置项 --------------------------
+# 原始规则所在的基线版本
+BASELINE_REVISION = "8b2edd6b67bd4ac52c6ccf7af1ec8b4920533b03"
+BASELINE_PATH = "adv_report_github.py"
+# 模拟流水的最后一天；运行日期固定为其后一天（规则中按"今天"取本周工作日等）
+END_DATE = date(2026, 10, 12)
+# 流水维度字段置空的比例（Advertiser不置空：原始规则在广告主为空时无法运行）
+BLANK_COLS = ["Adv Offer ID", "App ID", "GEO", "Total Caps", "Payin", "Status"]
+BLANK_RATE = 0.05
+# 报告sheet名称 → 原始规则结果中的名称
+BASELINE_KEYS = {
+    "1-总数据": "total",
+    "2-预算波动": "fluct",
+    "3-Advertiser数据": "adv",
+    "4-Affiliate数据": "aff",
+    "5-流水大幅下降预算": "drop",
+    "6-利润影响分析": "influence",
+    "7-reject事件分析": "reject_an",
+    "8-非reject事件分析": "nonreject_an",
+    "9-今日待办事项": "rules",
+}
+
+
+class FrozenDatetime(datetime):
+    """datetime.now()固定为END_DATE的后一天"""
+    @classmethod
+    def now(cls, tz=None):
+        return cls.combine(END_DATE + timedelta(days=1), datetime.min.time())
+
+
+def write_synthetic_workbook(path, seed, shuffle):
+    """生成模拟workbook：维度字段随机置空，shuffle时打乱流水行顺序"""
+    sheets = generate_sheets(n_offers=80, n_affiliates=20, n_advertisers=8, end_date=END_DATE, seed=seed)
+    rng = np.random.default_rng(seed)
+    flow = sheets["流水数据"]
+    for col in BLANK_COLS:
+        flow[col] = flow[col].astype(object).mask(rng.random(len(flow)) < BLANK_RATE)
+    if shuffle:
+        sheets["流水数据"] = flow.sample(frac=1, random_state=seed).reset_index(drop=True)
+    write_workbook(sheets, path)
+
+
+@pytest.fixture(scope="module")
+def baseline_rules():
+    """从git历史读取基线版本的页面脚本作为原始规则模块（页面逻辑只在作为脚本运行时执行）"""
+    try:
+        source = subprocess.run(
+            ["git", "show", f"{BASELINE_REVISION}:{BASELINE_PATH}"],
+            cwd=REPO_DIR, capture_output=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip(f"无法从git读取基线版本 {BASELINE_REVISION}")
+    module = types.ModuleType("baseline_rules")
+    exec(compile(source, f"{BASELINE_REVISION}:{BASELINE_PATH}", "exec"), module.__dict__)
+    return module
+
+
+def run_baseline(baseline_rules, path):
+    """按原始页面的调用顺序运行原始规则（部分规则会原地修改offer_base_info，顺序不能改变）"""
+    sheets, offer_base_info = baseline_rules.load_excel_template(path)
+    results = {}
+    results["total"], date_new, date_old = baseline_rules.calculate_total_data(sheets)
+    results["fluct"] = baseline_rules.calculate_budget_fluctuation(sheets, offer_base_info)
+    reject_event_df = baseline_rules.calculate_reject_data(sheets)
+    results["adv"] = baseline_rules.calculate_advertiser_data(sheets, date_new, date_old, reject_event_df)
+    results["aff"] = baseline_rules.calculate_affiliate_data(sheets, date_new, date_old, reject_event_df)
+    results["drop"] = baseline_rules.calculate_large_drop_budget(sheets, offer_base_info)
+    results["influence"] = baseline_rules.calculate_profit_influence(sheets, date_new, date_old)
+    results["rules"] = baseline_rules.calculate_budget_rules(sheets, offer_base_info)
+    results["reject_an"], results["nonreject_an"] = baseline_rules.calculate_event_analysis(sheets, offer_base_info)
+    return results
+
+
+@pytest.mark.parametrize("seed, shuffle", [(1, False), (2, True)])
+def test_report_matches_baseline(tmp_path, monkeypatch, baseline_rules, seed, shuffle):
+    monkeypatch.setattr(adv_report_core, "datetime", FrozenDatetime)
+    monkeypatch.setattr(baseline_rules, "datetime", FrozenDatetime)
+    monkeypatch.setattr(adv_report_core, "WORKBOOK_CACHE_DIR", str(tmp_path / "cache"))
+    path = str(tmp_path / "workbook.xlsx")
+    write_synthetic_workbook(path, seed, shuffle)
+
+    expected = run_baseline(baseline_rules, path)
+    sheets, offer_base_info = adv_report_core.load_excel_template(path)
+    results = adv_report_core.run_analysis(sheets, offer_base_info)
+
+    # 原始页面的9个sheet在前，之后是新增的维度对比sheet
+    assert list(results) == [*BASELINE_KEYS, *adv_report_core.DIMENSION_COMPARE_SHEETS]
+    # 逐个sheet比较，汇总全部不一致的sheet及完整差异后一起报告
+    failures = []
+    for sheet_name, key in BASELINE_KEYS.items():
+        if key == "influence":
+            if results[sheet_name].iloc[0, 0] != expected[key]:
+                failures.append(f"{sheet_name}：结论文字不一致\n当前：{results[sheet_name].iloc[0, 0]}\n原始：{expected[key]}")
+            continue
+        assert len(expected[key]) > 0, f"{sheet_name}：模拟数据没有覆盖该规则"
+        try:
+            pd.testing.assert_frame_equal(
+                results[sheet_name].reset_index(drop=True), expected[key].reset_index(drop=True),
+                check_exact=False, rtol=1e-9, obj=sheet_name
+            )
+        except AssertionError as e:
+            failures.append(str(e))
+    assert not failures, "\n\n".join(failures)
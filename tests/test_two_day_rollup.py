@@ -0,0 +1,87 @@
+# 最新两天汇总表：各层级小计与上层一致，Offer层级的reject数与event汇总一致
+import os
+import sys
+from datetime import date
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adv_report_core  # noqa: E402
+from adv_report_synth import generate_sheets  # noqa: E402
+
+
+# -------------------------- 配置项 --------------------------
+END_DATE = date(2026, 10, 12)
+VALUE_COLS = [f"{label} {metric}" for label in adv_report_core.TWO_DAY_LABELS for metric in ["Revenue", "Profit", "Conversions"]]
+
+
+@pytest.fixture(scope="module")
+def report_inputs():
+    """模拟数据预处理后的sheets，以及最新两天和reject事件
+    各层级和原始规则一样不统计分组字段为空的行，这里补齐空的Affiliate，使各层级的合计可以直接比较
+    """
+    raw = generate_sheets(n_offers=40, n_affiliates=10, n_advertisers=6, end_date=END_DATE, seed=3)
+    raw["流水数据"]["Affiliate"] = raw["流水数据"]["Affiliate"].fillna("aff_blank")
+    sheets, _ = adv_report_core.prepare_sheets(raw)
+    date_new, date_old = adv_report_core.latest_two_days(sheets["流水汇总"])
+    reject_event_df = adv_report_core.calculate_reject_data(sheets)
+    return sheets, date_new, date_old, reject_event_df
+
+
+@pytest.fixture(scope="module")
+def rollup(report_inputs):
+    return adv_report_core.build_two_day_rollup(*report_inputs)
+
+
+def level_rows(rollup, level):
+    dims = adv_report_core.ROLLUP_LEVELS[level]
+    return rollup.loc[rollup["汇总层级"] == level, [*dims, *VALUE_COLS]]
+
+
+@pytest.mark.parametrize("child, parent", [
+    ("三级广告主 > Advertiser", "三级广告主"),
+    ("三级广告主 > Advertiser > Offer", "三级广告主 > Advertiser"),
+    ("三级广告主 > Advertiser > Offer > Affiliate", "三级广告主 > Advertiser > Offer"),
+])
+def test_nested_levels_sum_to_parent(rollup, child, parent):
+    parent_dims = adv_report_core.ROLLUP_LEVELS[parent]
+    expected = level_rows(rollup, parent).set_index(parent_dims).sort_index()
+    summed = level_rows(rollup, child).groupby(parent_dims)[VALUE_COLS].sum().sort_index()
+    pd.testing.assert_frame_equal(summed, expected[VALUE_COLS], check_exact=False, rtol=1e-9)
+
+
+def test_single_levels_sum_to_total(rollup):
+    total = level_rows(rollup, "总体")[VALUE_COLS].iloc[0]
+    for level in ["Advertiser", "Offer", "Affiliate"]:
+        pd.testing.assert_series_equal(
+            level_rows(rollup, level)[VALUE_COLS].sum(), total, check_names=False, check_exact=False, rtol=1e-9
+        )
+
+
+def test_offer_level_reject_counts(report_inputs, rollup):
+    _, date_new, _, reject_event_df = report_inputs
+    rejects = reject_event_df[(reject_event_df["是否为reject"] == True) & (reject_event_df["Time"] == date_new)]
+    expected = rejects.groupby("Offer Id")["事件数"].sum()
+    offers = rollup[rollup["汇总层级"] == "Offer"].set_index("Offer Id")["最新 Total reject"]
+    assert expected.sum() > 0
+    pd.testing.assert_series_equal(
+        offers.reindex(expected.index), expected.astype(float), check_names=False
+    )
+
+
+@pytest.mark.parametrize("dim", ["GEO", "App ID"])
+def test_dimension_data_matches_flow(report_inputs, dim):
+    sheets, date_new, date_old, reject_event_df = report_inputs
+    table = adv_report_core.calculate_dimension_data(sheets, date_new, date_old, reject_event_df, [dim])
+    flow = sheets["流水汇总"]
+    for day in [date_new, date_old]:
+        expected = flow[flow["Time"] == day].groupby(dim, observed=True)["Total Revenue"].sum()
+        expected.index = expected.index.astype(object)
+        actual = table.set_index(dim)[f"{day} Total Revenue"]
+        pd.testing.assert_series_equal(
+            actual[actual != 0].sort_index(), expected[expected != 0].astype(float).sort_index(),
+            check_names=False, check_exact=False, rtol=1e-9
+        )
+    assert f"{date_new} reject率" not in table.columns